@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+from embedding_store import as_store
+
+# Approximate nearest-neighbour search over the (unit length) venue embeddings: an IVF
+# index. Spherical k-means splits the embedding space into ANN_LISTS cells, each venue
+# is filed under its closest centroid, and a query only scores the venues in the
+# ANN_PROBES cells closest to it. More probes means better recall and slower queries.
+# The index only holds centroids and row positions; vectors are read from the venue
+# index's embedding store, so it adds almost no memory on top of it. Everything here
+# works in the store's (possibly PCA-reduced) space: queries come from store.query().
+ANN_LISTS = int(os.getenv("VENUE_ANN_LISTS", "0"))  # 0: about sqrt(venues)
+ANN_PROBES = int(os.getenv("VENUE_ANN_PROBES", "16"))
+ANN_MIN_VENUES = int(os.getenv("VENUE_ANN_MIN_VENUES", "20000"))  # Exact search below this
+_CHUNK = 65536
+
+
+def default_lists(count):
+    return max(1, min(count, int(np.sqrt(count))))
+
+
+def nearest_centroids(vectors, centroids):
+    # Index of the most similar centroid for each vector, in chunks to bound memory
+    assigned = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK):
+        assigned[start:start + _CHUNK] = np.argmax(vectors[start:start + _CHUNK] @ centroids.T, axis=1)
+    return assigned
+
+
+def train_centroids(vectors, lists, iterations=10, sample=None, seed=0):
+    # Spherical k-means on a sample: centroids are re-normalized means of their members
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    sample = sample or max(lists * 64, 10000)
+    if len(vectors) > sample:
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, vectors)
+        empty = np.bincount(assigned, minlength=lists) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]  # Re-seed empty cells
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms > 0, norms, 1)
+    return centroids.astype(np.float32)
+
+
+def top_k(positions, scores, k):
+    # The k best (position, score) pairs, highest score first, ties by position
+    if len(positions) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        positions, scores = positions[keep], scores[keep]
+    order = np.lexsort((positions, -scores))
+    return positions[order], scores[order]
+
+
+def exact_search(embeddings, positions, query, k):
+    embeddings = as_store(embeddings)
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == len(embeddings):
+        scores = embeddings.dot(None, query)[positions]  # Every row: skip gathering them
+    else:
+        scores = embeddings.dot(positions, query)
+    return top_k(positions, scores, k)
+
+
+class IVFIndex:
+    def __init__(self, centroids, assigned, probes=ANN_PROBES):
+        # assigned: cell of every row position, -1 for rows not in the index
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assigned = np.array(assigned, dtype=np.int32)
+        self.probes = probes
+        order = np.argsort(self.assigned, kind="stable")
+        bounds = np.searchsorted(self.assigned[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(len(self.centroids))]
+        self.sizes = [len(rows) for rows in self.lists]
+
+    @classmethod
+    def build(cls, embeddings, positions, lists=None, probes=ANN_PROBES):
+        embeddings = as_store(embeddings)
+        positions = np.asarray(positions, dtype=np.int64)
+        lists = min(lists or ANN_LISTS or default_lists(len(positions)), len(positions))
+        vectors = embeddings[positions]
+        centroids = train_centroids(vectors, lists)
+        assigned = np.full(len(embeddings), -1, dtype=np.int32)
+        assigned[positions] = nearest_centroids(vectors, centroids)
+        return cls(centroids, assigned, probes)
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def assignments(self, positions):
+        # Cells of the given rows (-1 if not indexed), e.g. to persist a compacted copy
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(self.assigned):
+            return np.full(len(positions), -1, dtype=np.int32)
+        known = positions < len(self.assigned)
+        return np.where(known, self.assigned[np.minimum(positions, len(self.assigned) - 1)], -1).astype(np.int32)
+
+    def add(self, pos, vector):
+        self.remove(pos)
+        cell = int(np.argmax(self.centroids @ vector))
+        if pos >= len(self.assigned):
+            grown = np.full(max(pos + 1, 2 * len(self.assigned), 16), -1, dtype=np.int32)
+            grown[:len(self.assigned)] = self.assigned
+            self.assigned = grown
+        rows, size = self.lists[cell], self.sizes[cell]
+        if size == len(rows):
+            grown = np.empty(max(16, 2 * size), dtype=np.int64)
+            grown[:size] = rows
+            rows = self.lists[cell] = grown
+        rows[size] = pos
+        self.sizes[cell] = size + 1
+        self.assigned[pos] = cell
+
+    def remove(self, pos):
+        if pos >= len(self.assigned) or self.assigned[pos] < 0:
+            return
+        cell = self.assigned[pos]
+        rows, size = self.lists[cell], self.sizes[cell]
+        slot = int(np.flatnonzero(rows[:size] == pos)[0])
+        rows[slot] = rows[size - 1]  # Order within a cell doesn't matter
+        self.sizes[cell] = size - 1
+        self.assigned[pos] = -1
+
+    def search(self, embeddings, query, k, probes=None):
+        # Approximate top k (positions, scores) by cosine similarity
+        probes = min(probes or self.probes, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        candidates = np.concatenate([self.lists[cell][:self.sizes[cell]] for cell in cells])
+        if not len(candidates):
+            return candidates, np.empty(0, dtype=np.float32)
+        return top_k(candidates, as_store(embeddings).dot(candidates, query), k)
@@ -0,0 +1,68 @@
+from collections import deque
+
+# Aho-Corasick automaton over a query's keyword terms. Pattern i is reported as bit i of
+# an int mask, so "which of the user's terms occur in this text" is one linear pass over
+# the text however many terms there are, instead of one substring search per term.
+SEPARATOR = "\x00"  # Never inside a term: scanning restarts at the root after it
+
+
+class KeywordAutomaton:
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [0]
+        for i, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(0)
+                state = next_state
+            self.output[state] |= 1 << i
+
+        # Breadth-first failure links; each state also reports what its fallback reports
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+                queue.append(next_state)
+
+    def _step(self, state, char):
+        goto, fail = self.goto, self.fail
+        while state and char not in goto[state]:
+            state = fail[state]
+        return goto[state].get(char, 0)
+
+    def scan(self, text):
+        # Mask of the patterns occurring in text
+        state, found = 0, 0
+        for char in text:
+            state = self._step(state, char)
+            found |= self.output[state]
+        return found
+
+    def scan_terms(self, terms):
+        # {term: mask} for every term containing at least one pattern, from a single pass
+        # over the terms joined by SEPARATOR
+        found = {}
+        terms = list(terms)
+        term_index, state, mask = 0, 0, 0
+        for char in SEPARATOR.join(terms) + SEPARATOR:
+            if char == SEPARATOR:
+                if mask:
+                    found[terms[term_index]] = mask
+                term_index, state, mask = term_index + 1, 0, 0
+                continue
+            state = self._step(state, char)
+            mask |= self.output[state]
+        return found
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    # Collects concurrent encode requests and runs them as one batched call. The first
+    # request opens a window of max_wait seconds (cut short once max_batch_size texts
+    # are waiting); everything queued by then is encoded together in a worker thread,
+    # and requests arriving during that call form the next batch. Identical texts in
+    # flight at the same time share one slot, and a text whose requests were all
+    # cancelled before its batch was taken is dropped instead of encoded.
+    def __init__(self, encode_batch, max_batch_size=32, max_wait=0.005):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.pending = {}  # text -> [future, enqueued at, waiting requests], in arrival order
+        self._worker = None
+        self._ready = None
+        self._full = None
+        # Metrics
+        self.batches = 0
+        self.texts = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.batch_sizes = {}
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+
+    async def submit(self, text):
+        self._start()
+        entry = self.pending.get(text)
+        if entry is None:
+            entry = [asyncio.get_running_loop().create_future(), time.perf_counter(), 0]
+            self.pending[text] = entry
+            self._ready.set()
+            if len(self.pending) >= self.max_batch_size:
+                self._full.set()
+        else:
+            self.coalesced += 1
+        entry[2] += 1
+        try:
+            # Shielded: a cancelled request must not cancel the result others are waiting for
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            entry[2] -= 1
+            if entry[2] == 0 and self.pending.get(text) is entry:
+                del self.pending[text]
+                self.cancelled += 1
+                if not self.pending:
+                    self._ready.clear()
+            raise
+
+    def _start(self):
+        if self._worker is None or self._worker.done():
+            # Created here so they belong to the running event loop
+            self._ready = asyncio.Event()
+            self._full = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            if len(self.pending) < self.max_batch_size and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            texts = list(self.pending)[:self.max_batch_size]
+            if not texts:
+                self._ready.clear()  # Everything queued was cancelled
+                continue
+            batch = [(text, self.pending.pop(text)) for text in texts]
+            if len(self.pending) < self.max_batch_size:
+                self._full.clear()
+            if not self.pending:
+                self._ready.clear()
+            await self._encode(batch)
+
+    async def _encode(self, batch):
+        started = time.perf_counter()
+        for text, (future, enqueued_at, waiting) in batch:
+            delay = started - enqueued_at
+            self.queue_delay_total += delay
+            self.queue_delay_max = max(self.queue_delay_max, delay)
+        self.batches += 1
+        self.texts += len(batch)
+        self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+        try:
+            vectors = await asyncio.to_thread(self.encode_batch, [text for text, entry in batch])
+        except Exception as e:
+            for text, (future, enqueued_at, waiting) in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (text, (future, enqueued_at, waiting)), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_delay_ms": 1000 * self.queue_delay_total / self.texts if self.texts else 0.0,
+            "max_queue_delay_ms": 1000 * self.queue_delay_max,
+            "waiting": len(self.pending),
+        }
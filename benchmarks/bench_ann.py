@@ -0,0 +1,69 @@
+# Recall@15 and latency of the IVF index against exact cosine search, for a range of
+# probe counts. Uses clustered random unit vectors shaped like MiniLM embeddings, so it
+# runs without the model:
+#
+#   python benchmarks/bench_ann.py [--venues 100000 500000] [--lists 1000] [--probes 1 2 4 8 16 32]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann import IVFIndex, exact_search  # noqa: E402
+
+DIMENSIONS = 384
+K = 15
+
+
+def unit(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def clustered_vectors(count, rng, topics=200, spread=0.6):
+    # Venue embeddings bunch up by kind of venue; mimic that with noisy topic centres
+    centres = rng.standard_normal((topics, DIMENSIONS))
+    return unit(centres[rng.integers(topics, size=count)] + spread * rng.standard_normal((count, DIMENSIONS)))
+
+
+def run(venues, lists, probes, queries, rng):
+    embeddings = clustered_vectors(venues, rng)
+    positions = np.arange(venues)
+    queries = clustered_vectors(queries, rng)
+
+    started = time.perf_counter()
+    ann = IVFIndex.build(embeddings, positions, lists)
+    build_s = time.perf_counter() - started
+
+    exact, exact_ms = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found, _ = exact_search(embeddings, positions, query, K)
+        exact_ms.append((time.perf_counter() - started) * 1000)
+        exact.append(set(found.tolist()))
+
+    print(f"\n{venues} venues, {len(ann.centroids)} cells, built in {build_s:.1f}s")
+    print(f"{'search':<14}{'recall@15':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{np.percentile(exact_ms, 50):>10.2f}{np.percentile(exact_ms, 95):>10.2f}")
+    for probe_count in probes:
+        recalls, latencies = [], []
+        for query, expected in zip(queries, exact):
+            started = time.perf_counter()
+            found, _ = ann.search(embeddings, query, K, probe_count)
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len(expected & set(found.tolist())) / K)
+        label = f"ivf probes={probe_count}"
+        print(f"{label:<14}{np.mean(recalls):>10.3f}{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--venues", type=int, nargs="+", default=[100000, 500000])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--lists", type=int, default=None, help="IVF cells (default: VENUE_ANN_LISTS or about sqrt(venues))")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    for venues in args.venues:
+        run(venues, args.lists, args.probes, args.queries, rng)
@@ -0,0 +1,73 @@
+# Compare compressed bitmap AND/OR/ANDNOT with Python set operations on filter-sized
+# posting lists:
+#
+#   python benchmarks/bench_bitmaps.py [--venues 100000 1000000]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bitmaps import Bitmap  # noqa: E402
+
+# Fraction of venues in each posting list, roughly: a big city, a common style,
+# a capacity band and a rare keyword
+DENSITIES = {"city": 0.05, "style": 0.2, "capacity": 0.3, "keyword": 0.01}
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def run(venues, repeat, rng):
+    postings = {name: np.sort(rng.choice(venues, int(venues * density), replace=False)).astype(np.uint32) for name, density in DENSITIES.items()}
+    sets = {name: set(rows.tolist()) for name, rows in postings.items()}
+    bitmaps = {name: Bitmap.from_positions(rows) for name, rows in postings.items()}
+
+    cases = {
+        "city AND style": (
+            lambda: sets["city"] & sets["style"],
+            lambda: bitmaps["city"] & bitmaps["style"],
+        ),
+        "city AND style AND capacity AND keyword": (
+            lambda: sets["city"] & sets["style"] & sets["capacity"] & sets["keyword"],
+            lambda: Bitmap.and_all([bitmaps["city"], bitmaps["style"], bitmaps["capacity"], bitmaps["keyword"]]),
+        ),
+        "style OR capacity": (
+            lambda: sets["style"] | sets["capacity"],
+            lambda: bitmaps["style"] | bitmaps["capacity"],
+        ),
+        "capacity ANDNOT style": (
+            lambda: sets["capacity"] - sets["style"],
+            lambda: bitmaps["capacity"] - bitmaps["style"],
+        ),
+    }
+
+    print(f"\n{venues} venues")
+    print(f"{'operation':<42}{'set (ms)':>10}{'bitmap (ms)':>13}{'speedup':>9}")
+    for name, (with_sets, with_bitmaps) in cases.items():
+        set_ms, expected = timed(with_sets, repeat)
+        bitmap_ms, result = timed(with_bitmaps, repeat)
+        assert set(result.to_array().tolist()) == expected, name
+        print(f"{name:<42}{set_ms:>10.3f}{bitmap_ms:>13.3f}{set_ms / bitmap_ms:>8.1f}x")
+
+    set_bytes = sum(sys.getsizeof(s) + 28 * len(s) for s in sets.values())
+    bitmap_bytes = sum(c.nbytes for b in bitmaps.values() for c in b.containers.values())
+    print(f"memory: sets ~{set_bytes / 1e6:.1f} MB, bitmaps {bitmap_bytes / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--venues", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    for venues in args.venues:
+        run(venues, args.repeat, rng)
@@ -0,0 +1,112 @@
+# Load time, memory, query embedding latency and agreement with the reference model for
+# each embedding backend. Every backend runs in its own fresh process so memory (torch
+# vs ONNX Runtime) is measured in isolation:
+#
+#   python benchmarks/bench_embedders.py --onnx-path models/all-MiniLM-L6-v2-onnx [--queries 200]
+#
+# The ONNX directory holds model.onnx and tokenizer.json, e.g. from
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 models/all-MiniLM-L6-v2-onnx
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODEL = 'all-MiniLM-L6-v2'
+STYLES = ["rustic", "industrial", "modern", "garden", "barn", "ballroom", "rooftop", "loft", "vineyard", "beach"]
+KEYWORDS = ["outdoor", "live music", "wedding", "parking", "catering", "dance floor", "pet friendly", "lake view",
+            "wheelchair accessible", "bar", "stage", "string lights", "historic", "private room"]
+CITIES = ["austin", "new york", "chicago", "denver", "nashville", "portland", ""]
+
+
+def query_texts(count, rng):
+    # Shaped like search_query_text: styles, keywords and city
+    texts = []
+    for _ in range(count):
+        parts = (", ".join(rng.sample(STYLES, rng.randint(0, 2))), ", ".join(rng.sample(KEYWORDS, rng.randint(1, 3))), rng.choice(CITIES))
+        texts.append(". ".join(part for part in parts if part))
+    return texts
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Peak, on systems without /proc
+
+
+def measure(backend, onnx_path, quantize, texts, results):
+    # Runs in a spawned process; the settings are read by embedders at import
+    os.environ["EMBEDDING_BACKEND"] = backend
+    if onnx_path:
+        os.environ["EMBEDDING_ONNX_PATH"] = onnx_path
+    os.environ["EMBEDDING_ONNX_QUANTIZE"] = "1" if quantize else "0"
+    from embedders import load_embedder
+
+    before = rss_mb()
+    started = time.perf_counter()
+    model = load_embedder(MODEL)
+    load_s = time.perf_counter() - started
+    model.encode(texts[:8], normalize_embeddings=True)  # Warm-up
+
+    single_ms = []
+    for text in texts:
+        started = time.perf_counter()
+        model.encode([text], batch_size=1, normalize_embeddings=True)
+        single_ms.append((time.perf_counter() - started) * 1000)
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=32, normalize_embeddings=True)
+    batch_ms = (time.perf_counter() - started) * 1000 / len(texts)
+    results.put({
+        "load_s": load_s,
+        "rss_mb": rss_mb() - before,
+        "p50_ms": float(np.percentile(single_ms, 50)),
+        "p95_ms": float(np.percentile(single_ms, 95)),
+        "batch_ms": batch_ms,
+        "vectors": np.asarray(vectors, dtype=np.float32),
+    })
+
+
+def run(backend, onnx_path, quantize, texts):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(backend, onnx_path, quantize, texts, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--onnx-path", default=os.getenv("EMBEDDING_ONNX_PATH"), help="directory with model.onnx and tokenizer.json")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    texts = query_texts(args.queries, random.Random(42))
+
+    runs = [("sentence-transformers", "sentence-transformers", False)]
+    if args.onnx_path:
+        runs += [("onnx", "onnx", False), ("onnx int8", "onnx", True)]
+    else:
+        print("no --onnx-path: only measuring the reference backend")
+
+    reference = None
+    print(f"{len(texts)} queries")
+    print(f"{'backend':<24}{'load (s)':>9}{'RSS (MB)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'batch32 (ms/q)':>16}{'cos mean':>10}{'cos min':>9}")
+    for label, backend, quantize in runs:
+        result = run(backend, args.onnx_path, quantize, texts)
+        if reference is None:
+            reference = result["vectors"]
+        agreement = np.sum(result["vectors"] * reference, axis=1)  # Both unit length
+        print(f"{label:<24}{result['load_s']:>9.1f}{result['rss_mb']:>10.0f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['batch_ms']:>16.2f}{agreement.mean():>10.4f}{agreement.min():>9.4f}")
@@ -0,0 +1,69 @@
+# Memory and ranking drift of the compact venue embedding storage types against full
+# float32 vectors. Drift is recall@15 of an exact scan over the compact store against
+# the full-precision top 15, plus the mean absolute error of those 15 similarities:
+#
+#   python benchmarks/bench_embedding_storage.py [--snapshot venue_index.snapshot] [--venues 100000] [--dimensions 256 128]
+#
+# Uses the embeddings of a full-precision snapshot when given one, otherwise clustered
+# random vectors shaped like MiniLM embeddings (see bench_ann.py).
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann import exact_search  # noqa: E402
+from bench_ann import clustered_vectors  # noqa: E402
+from embedding_store import EmbeddingStore, STORAGE_TYPES  # noqa: E402
+from snapshot import load_snapshot  # noqa: E402
+
+K = 15
+
+
+def run(vectors, queries, storage, dimensions, reference):
+    started = time.perf_counter()
+    store = EmbeddingStore.build(vectors, storage, dimensions)
+    build_s = time.perf_counter() - started
+    positions = np.arange(len(vectors))
+    recalls, errors, latencies = [], [], []
+    for query, (expected, expected_scores) in zip(queries, reference):
+        projected = store.query(query)
+        started = time.perf_counter()
+        found, _ = exact_search(store, positions, projected, K)
+        latencies.append((time.perf_counter() - started) * 1000)
+        recalls.append(len(set(found.tolist()) & set(expected.tolist())) / K)
+        errors.append(np.abs(store.dot(expected, projected) - expected_scores).mean())
+    return store, build_s, np.mean(recalls), np.mean(errors), np.percentile(latencies, 50)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshot", help="full-precision snapshot to take embeddings from")
+    parser.add_argument("--venues", type=int, default=100000, help="synthetic vectors when there is no snapshot")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 128], help="PCA sizes to try besides the full model")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    if args.snapshot:
+        index = load_snapshot(args.snapshot)
+        if index is None or index.embeddings is None or index.embeddings.storage != "float32" or index.embeddings.components is not None:
+            sys.exit(f"{args.snapshot}: no snapshot with full-precision embeddings")
+        vectors = np.asarray(index.embeddings.codes)[index.positions()]
+        queries = vectors[rng.choice(len(vectors), args.queries)]  # Queries look like venues
+    else:
+        vectors = clustered_vectors(args.venues, rng)
+        queries = clustered_vectors(args.queries, rng)
+
+    full = EmbeddingStore(vectors)
+    reference = [exact_search(full, np.arange(len(vectors)), query, K) for query in queries]
+    print(f"{len(vectors)} venues x {vectors.shape[1]} dimensions, {len(queries)} queries")
+    print(f"{'storage':<10}{'dims':>6}{'bytes/venue':>13}{'total (MB)':>12}{'saved':>8}{'recall@15':>11}{'mean |err|':>12}{'scan p50 (ms)':>15}{'build (s)':>11}")
+    for dimensions in [0] + args.dimensions:
+        for storage in STORAGE_TYPES:
+            store, build_s, recall, error, scan_ms = run(vectors, queries, storage, dimensions, reference)
+            saved = 1 - store.nbytes / full.nbytes
+            print(f"{storage:<10}{store.dimensions:>6}{store.nbytes / len(store):>13.0f}{store.nbytes / 2**20:>12.1f}{saved:>8.0%}"
+                  f"{recall:>11.3f}{error:>12.4f}{scan_ms:>15.2f}{build_s:>11.1f}")
@@ -0,0 +1,77 @@
+# Latency and ranking quality of ranking=hybrid for different candidate counts N. Each
+# query is taken from a random venue's city/style/keywords; quality is the overlap of
+# the hybrid top 15 with reranking every venue that passes the filters (N = all):
+#
+#   python benchmarks/bench_hybrid.py [--snapshot venue_index.snapshot] [--candidates 15 50 100 250 1000]
+#
+# Needs a snapshot written with VENUE_INDEX_EMBEDDINGS=1 and the sentence model.
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import encode_queries, rerank_semantic, search_query_text, top_matches  # noqa: E402
+from snapshot import load_snapshot  # noqa: E402
+from tokens import normalize_city, normalize_terms  # noqa: E402
+
+K = 15
+
+
+def sample_query(index, rng):
+    venue = index.row(int(rng.choice(index.positions())))
+    return {
+        'capacity': str(venue.capacity) if venue.capacity and rng.random() < 0.5 else None,
+        'city_term': normalize_city(venue.city) if rng.random() < 0.5 else None,
+        'style_terms': normalize_terms(venue.style)[:1],
+        'keyword_terms': normalize_terms(venue.keywords)[:2],
+    }
+
+
+def hybrid(index, user_input, query, candidates):
+    positions = index.filter_bitmap({"city": [user_input['city_term']]}).to_array() if user_input['city_term'] else index.positions()
+    style_scores = index.style_masks.similarity(user_input['style_terms'], len(index))
+    keyword_masks = index.keyword_term_masks(user_input['keyword_terms']) if user_input['keyword_terms'] else {}
+    matches = top_matches(index, positions, user_input, style_scores, keyword_masks, candidates or len(positions))
+    return [venue.id for venue, similarity in rerank_semantic(index, matches, query, K)]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - started) * 1000, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshot", default=os.getenv("VENUE_SNAPSHOT_PATH", "venue_index.snapshot"))
+    parser.add_argument("--candidates", type=int, nargs="+", default=[15, 50, 100, 250, 1000])
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    index = load_snapshot(args.snapshot)
+    if index is None or index.embeddings is None:
+        sys.exit(f"{args.snapshot}: no snapshot with embeddings")
+    rng = random.Random(42)
+
+    queries, encode_ms = [], []
+    for _ in range(args.queries):
+        user_input = sample_query(index, rng)
+        ms, query = timed(lambda: encode_queries([search_query_text(user_input)])[0])
+        encode_ms.append(ms)
+        queries.append((user_input, query))
+
+    reference = [hybrid(index, user_input, query, None) for user_input, query in queries]
+    print(f"{len(index)} venues, {args.queries} queries, query embedding p50 {np.percentile(encode_ms, 50):.2f} ms")
+    print(f"{'N':>6}{'overlap@15':>12}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    for candidates in args.candidates + [None]:
+        overlaps, latencies = [], []
+        for (user_input, query), expected in zip(queries, reference):
+            ms, found = timed(lambda: hybrid(index, user_input, query, candidates))
+            latencies.append(ms)
+            overlaps.append(len(set(found) & set(expected)) / max(1, min(K, len(expected))))
+        label = "all" if candidates is None else candidates
+        print(f"{label:>6}{np.mean(overlaps):>12.3f}{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}")
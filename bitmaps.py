@@ -0,0 +1,185 @@
+import numpy as np
+
+# Roaring-style compressed bitmap over uint32 row positions. The universe is split into
+# 65536-wide chunks keyed by the high 16 bits; each non-empty chunk is stored as either
+#   - an array container: sorted uint16 low bits, while it holds <= ARRAY_MAX values, or
+#   - a bitmap container: 1024 uint64 words, once it is denser than that.
+# Sparse postings (a rare keyword) stay small, dense ones (a big city, a capacity band)
+# are combined 64 rows per machine word.
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+WORDS = CHUNK_SIZE // 64
+ARRAY_MAX = 4096
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def _is_words(container):
+    return container.dtype == np.uint64
+
+def _to_words(values):
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[values] = True
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+def _to_values(words):
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder="little")).astype(np.uint16)
+
+def _popcount(words):
+    return int(_POPCOUNT8[words.view(np.uint8)].sum())
+
+def _contains(words, values):
+    values = values.astype(np.uint64)
+    return ((words[values >> np.uint64(6)] >> (values & np.uint64(63))) & np.uint64(1)).astype(bool)
+
+def _shrink(words):
+    # Store a chunk in whichever container is smaller, None when it is empty
+    count = _popcount(words)
+    if count == 0:
+        return None
+    return _to_values(words) if count <= ARRAY_MAX else words
+
+def _grow(values):
+    if len(values) == 0:
+        return None
+    return _to_words(values) if len(values) > ARRAY_MAX else values
+
+
+def _and(a, b):
+    if _is_words(a) and _is_words(b):
+        return _shrink(a & b)
+    if _is_words(a):
+        a, b = b, a
+    if _is_words(b):
+        result = a[_contains(b, a)]
+    else:
+        result = np.intersect1d(a, b, assume_unique=True)
+    return result if len(result) else None
+
+def _or(a, b):
+    if _is_words(a) and _is_words(b):
+        return a | b
+    if _is_words(a):
+        a, b = b, a
+    if _is_words(b):
+        return b | _to_words(a)
+    return _grow(np.union1d(a, b).astype(np.uint16))
+
+def _andnot(a, b):
+    if _is_words(a) and _is_words(b):
+        return _shrink(a & ~b)
+    if _is_words(a):
+        return _shrink(a & ~_to_words(b))
+    if _is_words(b):
+        result = a[~_contains(b, a)]
+    else:
+        result = np.setdiff1d(a, b, assume_unique=True).astype(np.uint16)
+    return result if len(result) else None
+
+
+class Bitmap:
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_positions(cls, positions):
+        positions = np.unique(np.asarray(positions, dtype=np.uint32))
+        containers = {}
+        if len(positions):
+            high = positions >> CHUNK_BITS
+            keys, starts = np.unique(high, return_index=True)
+            ends = list(starts[1:]) + [len(positions)]
+            for key, start, end in zip(keys, starts, ends):
+                containers[int(key)] = _grow((positions[start:end] & 0xFFFF).astype(np.uint16))
+        return cls(containers)
+
+    @classmethod
+    def full(cls, count):
+        return cls.from_positions(np.arange(count, dtype=np.uint32))
+
+    def __len__(self):
+        return sum(_popcount(c) if _is_words(c) else len(c) for c in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __contains__(self, pos):
+        container = self.containers.get(pos >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = np.uint16(pos & 0xFFFF)
+        if _is_words(container):
+            return bool(_contains(container, np.array([low]))[0])
+        i = np.searchsorted(container, low)
+        return i < len(container) and container[i] == low
+
+    def to_array(self):
+        parts = []
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            values = _to_values(container) if _is_words(container) else container
+            parts.append((np.uint32(key) << np.uint32(CHUNK_BITS)) | values.astype(np.uint32))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.uint32)
+
+    # Containers are never modified in place, so results may share them with inputs
+    def __and__(self, other):
+        containers = {}
+        for key in self.containers.keys() & other.containers.keys():
+            result = _and(self.containers[key], other.containers[key])
+            if result is not None:
+                containers[key] = result
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for key, b in other.containers.items():
+            a = containers.get(key)
+            containers[key] = b if a is None else _or(a, b)
+        return Bitmap(containers)
+
+    def __sub__(self, other):
+        # AND NOT
+        containers = {}
+        for key, a in self.containers.items():
+            b = other.containers.get(key)
+            result = a if b is None else _andnot(a, b)
+            if result is not None:
+                containers[key] = result
+        return Bitmap(containers)
+
+    def add(self, pos):
+        key = pos >> CHUNK_BITS
+        single = np.array([pos & 0xFFFF], dtype=np.uint16)
+        container = self.containers.get(key)
+        self.containers[key] = single if container is None else _or(container, single)
+
+    def discard(self, pos):
+        key = pos >> CHUNK_BITS
+        container = self.containers.get(key)
+        if container is None:
+            return
+        result = _andnot(container, np.array([pos & 0xFFFF], dtype=np.uint16))
+        if result is None:
+            del self.containers[key]
+        else:
+            self.containers[key] = result
+
+    @staticmethod
+    def and_all(bitmaps):
+        # Intersect smallest-first so the running result shrinks as fast as possible
+        bitmaps = sorted(bitmaps, key=len)
+        if not bitmaps:
+            return Bitmap()
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            if not result:
+                break
+            result = result & bitmap
+        return result
+
+    @staticmethod
+    def or_all(bitmaps):
+        result = Bitmap()
+        for bitmap in bitmaps:
+            result = result | bitmap
+        return result
@@ -0,0 +1,153 @@
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+import heapq
+import math
+import re
+
+from tokens import normalize_term
+
+# Okapi BM25 over the words of a venue's name and keywords. Postings are kept per term;
+# for a query, each term's list is compiled once into per-venue score contributions
+# (IDF and length norm folded in) plus the list's maximum contribution, which is what
+# MaxScore pruning needs to skip venues that cannot reach the current top k.
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+def venue_words(name, keyword_tokens):
+    # Keyword tokens are already normalized at write time, the name is not
+    words = [normalize_term(word) for word in _WORD.findall(name or "")]
+    for keyword in keyword_tokens or ():
+        words.extend(_WORD.findall(keyword))
+    return words
+
+
+def query_words(keyword_terms):
+    return [word for term in keyword_terms for word in _WORD.findall(term)]
+
+
+class BM25Index:
+    def __init__(self, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {position: term frequency}
+        self.documents = {}  # position -> Counter of its terms
+        self.lengths = {}  # position -> number of words
+        self.total_length = 0
+        self._impacts = {}
+
+    @classmethod
+    def build(cls, documents, **params):
+        # documents: iterable of (position, words)
+        index = cls(**params)
+        for pos, words in documents:
+            index.set_document(pos, words)
+        return index
+
+    def __len__(self):
+        return len(self.documents)
+
+    def set_document(self, pos, words):
+        self.remove_document(pos)
+        counts = Counter(words)
+        self.documents[pos] = counts
+        self.lengths[pos] = len(words)
+        self.total_length += len(words)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[pos] = tf
+        self._impacts.clear()  # N and the average length changed, so every IDF and norm did
+
+    def remove_document(self, pos):
+        counts = self.documents.pop(pos, None)
+        if counts is None:
+            return
+        self.total_length -= self.lengths.pop(pos)
+        for term in counts:
+            postings = self.postings[term]
+            del postings[pos]
+            if not postings:
+                del self.postings[term]
+        self._impacts.clear()
+
+    def impacts(self, term):
+        # (sorted positions, score contribution at each, max contribution) for one term
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            postings = self.postings.get(term, {})
+            count = len(self.documents)
+            average_length = self.total_length / count if count else 0.0
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            positions = sorted(postings)
+            scores = []
+            for pos in positions:
+                tf = postings[pos]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[pos] / average_length)
+                scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            impacts = (positions, scores, max(scores, default=0.0))
+            self._impacts[term] = impacts
+        return impacts
+
+    def top_k(self, words, k, allowed=None):
+        # Best k (position, score) pairs for the query words, highest first (ties by
+        # position), restricted to positions in `allowed` when given. MaxScore: lists
+        # are ordered by their max contribution, and the low ones whose maxima together
+        # cannot beat the k-th best score only get probed for venues already found
+        # through the others.
+        lists = sorted((self.impacts(term) for term in dict.fromkeys(words) if term in self.postings), key=lambda l: l[2])
+        if not lists or k <= 0:
+            return []
+        bounds = list(accumulate(l[2] for l in lists))
+        cursors = [0] * len(lists)
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+
+        while True:
+            candidate = None
+            for i in range(first_essential, len(lists)):
+                positions = lists[i][0]
+                if cursors[i] < len(positions) and (candidate is None or positions[cursors[i]] < candidate):
+                    candidate = positions[cursors[i]]
+            if candidate is None:
+                break
+
+            # Contributions are summed with fsum at the end so a venue's score doesn't
+            # depend on which lists it was found through
+            parts = []
+            for i in range(first_essential, len(lists)):
+                positions, scores, _ = lists[i]
+                cursor = cursors[i]
+                if cursor < len(positions) and positions[cursor] == candidate:
+                    parts.append(scores[cursor])
+                    cursors[i] = cursor + 1
+            if allowed is not None and candidate not in allowed:
+                continue
+
+            score = sum(parts)
+            for i in range(first_essential - 1, -1, -1):
+                if score + bounds[i] <= threshold:
+                    break
+                positions, scores, _ = lists[i]
+                j = bisect_left(positions, candidate, cursors[i])
+                cursors[i] = j  # Candidates only increase, so earlier entries are done
+                if j < len(positions) and positions[j] == candidate:
+                    parts.append(scores[j])
+                    score += scores[j]
+            else:
+                score = math.fsum(parts)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -candidate))
+            else:
+                continue
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(lists) and bounds[first_essential] <= threshold:
+                    first_essential += 1
+
+        return [(-neg_pos, score) for score, neg_pos in sorted(heap, key=lambda h: (-h[0], -h[1]))]
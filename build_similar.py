@@ -0,0 +1,37 @@
+# Recompute the "similar venues" list of every venue into venue_neighbours, e.g. after a
+# bulk load or changing the embedding model. Writes through the API patch the lists
+# themselves, so this only needs to run now and then:
+#
+#   python -m build_similar
+#   python -m build_similar --batch-size 1024
+import argparse
+import sys
+import time
+
+from main import SIMILAR_BATCH_SIZE, build_similar_venues, open_session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the similar venues of every venue")
+    parser.add_argument("--batch-size", type=int, default=SIMILAR_BATCH_SIZE, help="venues scored and written per transaction")
+    args = parser.parse_args()
+
+    def progress(stats):
+        print(f"{stats['done']}/{stats['venues']} venues ({stats['done'] / max(stats['elapsed_s'], 1e-9):.0f} venues/s)", file=sys.stderr)
+
+    started = time.time()
+    db = open_session()
+    try:
+        stats = build_similar_venues(db, args.batch_size, on_batch=progress)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+
+    print(f"Done: {stats['neighbours']} neighbours for {stats['venues']} venues in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
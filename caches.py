@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+class LRUCache:
+    # Bounded mapping that evicts the least recently used entry, with hit/miss counters
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, predicate):
+        # Drop every entry whose key matches predicate(key)
+        with self._lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SearchResultCache(LRUCache):
+    # Search results keyed by normalized query. Keys start with the normalized city
+    # filter (or None) and end with the ranking, so a venue write only has to drop
+    # unfiltered queries, the queries filtered on the venue's old or new city, and every
+    # BM25 query, whose IDF and average document length span the whole catalogue. Every
+    # invalidation bumps the generation, and a result computed before one (passed with
+    # the generation read when the search started) is not stored, as it may predate the
+    # change.
+    def __init__(self, max_entries):
+        super().__init__(max_entries)
+        self.generation = 0
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+        super().put(key, value)
+
+    def invalidate_cities(self, cities):
+        cities = set(cities)
+        with self._lock:
+            self.generation += 1
+        self.discard(lambda key: key[0] is None or key[0] in cities or key[-1] == "bm25")
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+        super().clear()
+
+
+class EmbeddingCache(LRUCache):
+    # Query text -> embedding vector, so the model only runs on phrases it hasn't seen.
+    # With a directory, misses fall through to a disk tier (one .npy file per text) that
+    # survives restarts and is shared by workers. Keys include the model name, so
+    # switching models never serves another model's vectors.
+    def __init__(self, max_entries, directory=None, model_name=""):
+        super().__init__(max_entries)
+        self.directory = directory
+        self.model_name = model_name
+        self.disk_hits = 0
+        self.computed = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, text):
+        digest = hashlib.sha256(("%s\0%s" % (self.model_name, text)).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".npy")
+
+    def lookup(self, text):
+        # Memory tier, then disk tier; None if the text still has to be encoded
+        vector = self.get(text)
+        if vector is None and self.directory:
+            try:
+                vector = np.load(self._path(text))
+            except (OSError, ValueError):
+                return None
+            self.disk_hits += 1
+            vector.setflags(write=False)
+            self.put(text, vector)
+        return vector
+
+    def store(self, text, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.setflags(write=False)  # Shared between requests
+        self.computed += 1
+        self.put(text, vector)
+        if self.directory:
+            self._write(text, vector)
+        return vector
+
+    def _write(self, text, vector):
+        path = self._path(text)
+        tmp_path = "%s.tmp.%d" % (path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, vector)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing query embedding cache: {e}")
+
+    def stats(self):
+        return dict(super().stats(), disk_hits=self.disk_hits, computed=self.computed)
@@ -0,0 +1,119 @@
+import os
+import tempfile
+
+import numpy as np
+
+# Sentence embedding backends. Both turn a list of texts into a (texts, dimensions)
+# float32 matrix through encode(texts, batch_size, normalize_embeddings):
+#   sentence-transformers  the reference PyTorch model, downloaded by name
+#   onnx                   the same model exported to ONNX (model.onnx + tokenizer.json
+#                          in EMBEDDING_ONNX_PATH), run with ONNX Runtime on the CPU
+#                          without importing torch; EMBEDDING_ONNX_QUANTIZE=1 runs a
+#                          dynamically int8-quantized copy of it instead
+# Heavy imports happen in the constructors, so only the chosen backend is loaded.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH")
+EMBEDDING_ONNX_QUANTIZE = os.getenv("EMBEDDING_ONNX_QUANTIZE", "0") == "1"
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # 0: ONNX Runtime's default
+MAX_SEQUENCE_LENGTH = 256  # Tokens, as the sentence-transformers model truncates
+
+BACKENDS = ("sentence-transformers", "onnx")
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False):
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=normalize_embeddings)
+
+
+def quantized_model(model_path):
+    # Dynamic int8 copy of an ONNX model (weights quantized ahead of time, activations
+    # at run time), written next to it once and reused after that
+    target = model_path[:-len(".onnx")] + ".int8.onnx"
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(model_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        # Worker processes may start together: write aside and rename into place
+        handle, temp_path = tempfile.mkstemp(suffix=".onnx", dir=os.path.dirname(target) or ".")
+        os.close(handle)
+        try:
+            quantize_dynamic(model_path, temp_path, weight_type=QuantType.QInt8)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return target
+
+
+class OnnxEmbedder:
+    # Tokenize, run the transformer, mean-pool over the non-padding tokens: the same
+    # steps as the sentence-transformers pipeline for MiniLM
+    def __init__(self, path, quantize=False, threads=EMBEDDING_ONNX_THREADS, max_length=MAX_SEQUENCE_LENGTH):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        model_path = os.path.join(path, "model.onnx")
+        if quantize:
+            model_path = quantized_model(model_path)
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        pad_token = "[PAD]" if self.tokenizer.token_to_id("[PAD]") is not None else None
+        if pad_token:
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        else:
+            self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        output = self.session.get_outputs()[0]  # last_hidden_state: (batch, tokens, dimensions)
+        self.output_name = output.name
+        self.dimensions = output.shape[-1] if isinstance(output.shape[-1], int) else None
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False):
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size, normalize_embeddings)[0]
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feed = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": mask,
+            }
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            hidden = self.session.run([self.output_name], feed)[0]
+            weights = mask[..., None].astype(np.float32)
+            batches.append((hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9))
+        if not batches:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+        vectors = np.concatenate(batches).astype(np.float32)
+        return normalize(vectors) if normalize_embeddings else vectors
+
+
+def load_embedder(model_name, backend=None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbedder(model_name)
+    if backend == "onnx":
+        if not EMBEDDING_ONNX_PATH:
+            raise ValueError("EMBEDDING_BACKEND=onnx needs EMBEDDING_ONNX_PATH")
+        return OnnxEmbedder(EMBEDDING_ONNX_PATH, quantize=EMBEDDING_ONNX_QUANTIZE)
+    raise ValueError(f"unknown EMBEDDING_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def embedder_name(model_name, backend=None):
+    # Identifies the vectors a backend produces, e.g. to key cached embeddings: the ONNX
+    # export is near-identical to the reference, the int8 one measurably less so
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        return f"{model_name}:onnx-int8" if EMBEDDING_ONNX_QUANTIZE else f"{model_name}:onnx"
+    return model_name
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+
+# Storage for the venue embedding matrix. Vectors are kept as
+#   float32  4 bytes per dimension, exact
+#   float16  2 bytes per dimension
+#   int8     1 byte per dimension plus a float32 scale per venue: each vector is
+#            divided by max|x| / 127 and rounded (symmetric scalar quantization)
+# optionally after a PCA down to VENUE_EMBEDDING_DIMENSIONS dimensions, re-normalized
+# so dot products are still cosine similarities (in the reduced space). Queries are
+# projected the same way, and similarities are computed from the stored codes a chunk
+# at a time, so there is never a full float32 copy of the matrix.
+EMBEDDING_STORAGE = os.getenv("VENUE_EMBEDDING_STORAGE", "float32")
+EMBEDDING_DIMENSIONS = int(os.getenv("VENUE_EMBEDDING_DIMENSIONS", "0"))  # 0 keeps every dimension
+STORAGE_TYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+PCA_SAMPLE = 50000
+_CHUNK = 65536
+_SCAN_CHUNK = 1024  # Rows converted to float32 at a time when scoring; small enough to stay in cache
+
+
+def fit_pca(vectors, dimensions, sample=PCA_SAMPLE, seed=0):
+    # (mean, components) of the top principal directions, fitted on a sample
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) > sample:
+        vectors = vectors[np.random.default_rng(seed).choice(len(vectors), sample, replace=False)]
+    mean = vectors.mean(axis=0)
+    _, _, directions = np.linalg.svd(vectors - mean, full_matrices=False)
+    components = np.zeros((dimensions, vectors.shape[1]), dtype=np.float32)  # Zero rows past the sample's rank
+    components[:min(dimensions, len(directions))] = directions[:dimensions]
+    return mean.astype(np.float32), components
+
+
+def as_store(embeddings):
+    # Plain float32 matrices (e.g. in benchmarks) work wherever a store is expected
+    if embeddings is None or isinstance(embeddings, EmbeddingStore):
+        return embeddings
+    return EmbeddingStore(np.asarray(embeddings, dtype=np.float32))
+
+
+class EmbeddingStore:
+    def __init__(self, codes, scales=None, mean=None, components=None):
+        self.codes = codes  # [n, dimensions] in the storage type
+        self.scales = scales  # float32[n] for int8, else None
+        self.mean = mean
+        self.components = components  # [dimensions, model dimensions] when PCA-reduced
+
+    @classmethod
+    def build(cls, vectors, storage=None, dimensions=None):
+        storage = storage or EMBEDDING_STORAGE
+        dimensions = EMBEDDING_DIMENSIONS if dimensions is None else dimensions
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"unknown VENUE_EMBEDDING_STORAGE {storage!r}, expected one of {', '.join(STORAGE_TYPES)}")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        mean = components = None
+        if dimensions and dimensions < vectors.shape[1] and len(vectors):
+            mean, components = fit_pca(vectors, dimensions)
+        width = vectors.shape[1] if components is None else len(components)
+        codes = np.zeros((len(vectors), width), dtype=STORAGE_TYPES[storage])
+        scales = np.zeros(len(vectors), dtype=np.float32) if storage == "int8" else None
+        store = cls(codes, scales, mean, components)
+        for start in range(0, len(vectors), _CHUNK):
+            store[start:start + _CHUNK] = vectors[start:start + _CHUNK]
+        return store
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def storage(self):
+        return np.dtype(self.codes.dtype).name
+
+    @property
+    def dimensions(self):
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def matches(self, storage=None, dimensions=None):
+        # Whether this is the configured storage type and PCA size
+        storage = storage or EMBEDDING_STORAGE
+        dimensions = EMBEDDING_DIMENSIONS if dimensions is None else dimensions
+        if self.storage != storage:
+            return False
+        model_dimensions = self.dimensions if self.components is None else self.components.shape[1]
+        if dimensions and dimensions < model_dimensions:
+            return self.components is not None and self.dimensions == dimensions
+        return self.components is None
+
+    def view(self, codes, scales):
+        # Same projection over other arrays, e.g. the index's growable buffers
+        return EmbeddingStore(codes, scales, self.mean, self.components)
+
+    def take(self, rows):
+        return self.view(self.codes[rows], None if self.scales is None else self.scales[rows])
+
+    def project(self, vectors):
+        # Model-space vectors to the stored space (unit length; zero vectors stay zero)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is None:
+            return vectors
+        present = np.any(vectors != 0, axis=-1, keepdims=True)
+        reduced = (vectors - self.mean) @ self.components.T
+        norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+        return np.where(present, reduced / np.where(norms > 0, norms, 1), 0).astype(np.float32)
+
+    def query(self, vector):
+        return self.project(vector[None])[0]
+
+    def __setitem__(self, rows, vectors):
+        # Encode model-space vectors into the given rows; None clears them
+        if vectors is None:
+            self.codes[rows] = 0
+            if self.scales is not None:
+                self.scales[rows] = 0
+            return
+        projected = self.project(vectors)
+        if self.scales is None:
+            self.codes[rows] = projected
+            return
+        scales = np.abs(projected).max(axis=-1) / 127
+        safe = np.where(scales > 0, scales, 1)
+        self.codes[rows] = np.rint(projected / (safe[..., None] if projected.ndim > 1 else safe)).astype(np.int8)
+        self.scales[rows] = scales
+
+    def __getitem__(self, rows):
+        # Decoded float32 vectors (in the stored space)
+        vectors = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            scales = self.scales[rows]
+            vectors *= scales[..., None] if vectors.ndim > 1 else scales
+        return vectors
+
+    def dot(self, rows, query):
+        # Similarity of each row (every row when None) to a query from query(), or to
+        # each column of a [dimensions, queries] matrix of them
+        if self.codes.dtype == np.float32:
+            return self._dot(slice(None) if rows is None else rows, query)
+        count = len(self) if rows is None else len(rows)
+        if count <= _SCAN_CHUNK:
+            return self._dot(slice(None) if rows is None else rows, query)
+        chunks = (slice(start, start + _SCAN_CHUNK) for start in range(0, count, _SCAN_CHUNK))
+        return np.concatenate([self._dot(chunk if rows is None else rows[chunk], query) for chunk in chunks])
+
+    def _dot(self, rows, query):
+        if self.codes.dtype == np.float32:
+            return self.codes[rows] @ query
+        scores = self.codes[rows].astype(np.float32) @ query
+        if self.scales is None:
+            return scores
+        scales = self.scales[rows]
+        return scores * (scales[:, None] if scores.ndim > 1 else scales)
+
+    def similarities(self, rows, vector):
+        return self.dot(rows, self.query(vector))
@@ -0,0 +1,216 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+# Sentence model inference in separate processes. Encoding holds the GIL for long
+# stretches, so running it in the server process (even on a thread) stalls the event
+# loop; here each worker process loads the model once and serves requests sent over a
+# pipe. Calls that take longer than the timeout (or whose worker died) kill and respawn
+# the worker, so a stuck encode can't wedge the pool.
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "30"))  # Seconds per call
+EMBEDDING_STARTUP_TIMEOUT = float(os.getenv("EMBEDDING_STARTUP_TIMEOUT", "300"))  # Seconds to load the model
+PING_TIMEOUT = 2.0
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def _serve(model_name, backend, connection):
+    # Worker process main loop: requests are (id, kind, payload), replies (id, ok, value)
+    from embedders import load_embedder
+    model = load_embedder(model_name, backend)
+    connection.send((None, True, os.getpid()))
+    while True:
+        try:
+            request_id, kind, payload = connection.recv()
+        except (EOFError, OSError):
+            return
+        if kind == "stop":
+            return
+        try:
+            if kind == "encode":
+                texts, options = payload
+                value = model.encode(texts, **options)
+            elif kind == "ping":
+                value = os.getpid()
+            else:
+                raise ValueError(f"unknown request {kind!r}")
+            connection.send((request_id, True, value))
+        except Exception as e:
+            connection.send((request_id, False, repr(e)))
+
+
+class EmbeddingWorker:
+    def __init__(self, model_name, backend, context):
+        self.model_name = model_name
+        self.backend = backend
+        self.context = context
+        self.process = None
+        self.connection = None
+        self.ready = False
+        self.request_ids = itertools.count()
+        # Metrics
+        self.calls = 0
+        self.texts = 0
+        self.busy_seconds = 0.0
+        self.restarts = 0
+        self.last_error = None
+
+    def start(self):
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(target=_serve, args=(self.model_name, self.backend, child), daemon=True)
+        self.process.start()
+        child.close()
+        self.connection = parent
+        self.ready = False
+
+    def stop(self, timeout=5.0):
+        if self.process is None:
+            return
+        try:
+            self.connection.send((None, "stop", None))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+        self.process = None
+        self.ready = False
+
+    def restart(self, reason):
+        print(f"Error in embedding worker {self.pid()}: {reason}; restarting")
+        self.last_error = reason
+        self.restarts += 1
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+            self.process = None
+        self.start()
+
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def _wait_ready(self):
+        if self.ready:
+            return
+        if not self.connection.poll(EMBEDDING_STARTUP_TIMEOUT):
+            self.restart("model did not load in time")
+            raise WorkerError("embedding worker did not start")
+        self._receive()
+        self.ready = True
+
+    def _receive(self):
+        try:
+            return self.connection.recv()
+        except (EOFError, OSError):
+            self.restart(f"exited with code {self.process.exitcode}")
+            raise WorkerError("embedding worker exited")
+
+    def call(self, kind, payload, timeout):
+        # One request/reply round trip; only one thread may use a worker at a time
+        if self.process is None:
+            self.start()
+        elif not self.process.is_alive():
+            self.restart(f"exited with code {self.process.exitcode}")
+        self._wait_ready()
+        request_id = next(self.request_ids)
+        self.connection.send((request_id, kind, payload))
+        while True:
+            if not self.connection.poll(timeout):
+                # Can't interrupt the model mid-batch: drop the process and the reply with it
+                self.restart(f"{kind} took longer than {timeout}s")
+                raise WorkerError(f"embedding worker timed out after {timeout}s")
+            reply_id, ok, value = self._receive()
+            if reply_id == request_id:
+                break
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+
+class EmbeddingWorkerPool:
+    # A fixed set of worker processes; each call takes an idle one, so concurrent calls
+    # (the query batcher, index syncs) run in parallel up to the number of processes
+    def __init__(self, model_name, processes=1, backend=None, timeout=EMBEDDING_TIMEOUT):
+        context = multiprocessing.get_context("spawn")  # Forking a process with torch loaded isn't safe
+        self.workers = [EmbeddingWorker(model_name, backend, context) for _ in range(max(1, processes))]
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for worker in self.workers:
+                worker.start()
+                self.idle.put(worker)
+            self._started = True
+
+    def close(self):
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
+            self._started = False
+            self.idle = queue.Queue()
+
+    def encode(self, texts, **options):
+        self.start()
+        worker = self.idle.get()
+        started = time.perf_counter()
+        try:
+            vectors = worker.call("encode", (list(texts), options), self.timeout)
+        finally:
+            worker.busy_seconds += time.perf_counter() - started
+            self.idle.put(worker)
+        worker.calls += 1
+        worker.texts += len(texts)
+        return vectors
+
+    def health(self):
+        # Pings the idle workers (busy ones are evidently alive) and restarts dead ones
+        self.start()
+        report = []
+        for worker in self.workers:
+            report.append({"pid": worker.pid(), "status": "busy", "restarts": worker.restarts, "last_error": worker.last_error})
+        taken = []
+        try:
+            while True:
+                taken.append(self.idle.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            for worker in taken:
+                entry = report[self.workers.index(worker)]
+                if not worker.ready and worker.process.is_alive() and not worker.connection.poll(0):
+                    entry["status"] = "loading"
+                    continue
+                try:
+                    worker.call("ping", None, PING_TIMEOUT)
+                    entry["status"] = "ok"
+                except WorkerError:
+                    entry["status"] = "restarting"
+                entry["pid"] = worker.pid()
+                entry["restarts"] = worker.restarts
+                entry["last_error"] = worker.last_error
+        finally:
+            for worker in taken:
+                self.idle.put(worker)
+        return report
+
+    def stats(self):
+        return [{
+            "pid": worker.pid(),
+            "calls": worker.calls,
+            "texts": worker.texts,
+            "busy_seconds": round(worker.busy_seconds, 3),
+            "restarts": worker.restarts,
+        } for worker in self.workers]
@@ -0,0 +1,42 @@
+# Bulk-load venues from a CSV or JSON Lines file:
+#
+#   python -m ingest venues.csv
+#   python -m ingest venues.jsonl --batch-size 5000
+#   cat venues.csv | python -m ingest - --format csv
+import argparse
+import sys
+import time
+
+from main import INGEST_BATCH_SIZE, ingest_venues, open_session, read_venue_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upsert venues from a CSV or JSON Lines file")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="rows per INSERT and per transaction")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    started = time.time()
+
+    def progress(stats):
+        elapsed = time.time() - started
+        print(f"{stats['upserted']} upserted, {stats['rejected']} rejected ({stats['upserted'] / max(elapsed, 1e-9):.0f} rows/s)", file=sys.stderr)
+
+    stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+    db = open_session()
+    try:
+        stats = ingest_venues(db, read_venue_records(stream, fmt), args.batch_size, on_batch=progress)
+    finally:
+        db.close()
+        stream.close()
+
+    for error in stats["errors"]:
+        print(f"record {error['record']}: {error['detail']}", file=sys.stderr)
+    print(f"Done: {stats['received']} received, {stats['upserted']} upserted, {stats['rejected']} rejected in {time.time() - started:.1f}s")
+    return 1 if stats["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy import Column, Integer, String, Text, LargeBinary, create_engine  # Added create_engine import
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, JSON, LargeBinary, ForeignKey, Index, create_engine, event, insert, select, func, or_, and_, inspect  # Added create_engine import
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
-from sentence_transformers import SentenceTransformer, util
 import os
+import asyncio
+import csv
+import heapq
+import io
+import json
+import secrets
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
 import mysql.connector
 import numpy as np
 import base64
 from PIL import Image
 from io import BytesIO
+from venue_index import VenueIndex, VENUE_FIELDS, TOKEN_FIELDS, venue_text, capacity_similarity
+from tokens import normalize_term, normalize_terms, normalize_city
+from caches import SearchResultCache, EmbeddingCache
+from batching import MicroBatcher
+from embedding_worker import EmbeddingWorkerPool
+from embedders import load_embedder, embedder_name
+from embedding_store import EmbeddingStore
+from snapshot import load_snapshot, write_snapshot, snapshot_is_stale
+from similar import SIMILAR_K, SIMILAR_BATCH_SIZE, similar_venues, nearest_sources, similarity_scores
+from bm25 import query_words
 
 app = FastAPI()
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
 # Enable CORS
 app.add_middleware(
@@ -22,11 +44,40 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Search-Corrections"],
 )
 
 # Load environment variables
 load_dotenv()
 
+# In-memory venue index and its on-disk snapshot
+SNAPSHOT_PATH = os.getenv("VENUE_SNAPSHOT_PATH", "venue_index.snapshot")
+SNAPSHOT_MAX_AGE = float(os.getenv("VENUE_SNAPSHOT_MAX_AGE")) if os.getenv("VENUE_SNAPSHOT_MAX_AGE") else None  # Seconds
+INDEX_EMBEDDINGS = os.getenv("VENUE_INDEX_EMBEDDINGS", "1") == "1"
+BATCH_GET_MAX_IDS = int(os.getenv("VENUE_BATCH_GET_MAX_IDS", "100"))
+INGEST_BATCH_SIZE = int(os.getenv("VENUE_INGEST_BATCH_SIZE", "1000"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))  # 0 disables the result cache
+HYBRID_CANDIDATES = int(os.getenv("SEARCH_HYBRID_CANDIDATES", "100"))  # Venues reranked by ranking=hybrid
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))  # 0 disables the memory tier
+QUERY_EMBEDDING_CACHE_DIR = os.getenv("QUERY_EMBEDDING_CACHE_DIR")  # Optional disk tier
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))  # How long the first query waits for others
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", 'all-MiniLM-L6-v2')
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))  # Processes running the model, 0 runs it in the server process
+CHANGE_POLL_INTERVAL = float(os.getenv("VENUE_CHANGE_POLL_INTERVAL", "5"))  # Seconds, 0 disables the poller
+CHANGE_BATCH_SIZE = int(os.getenv("VENUE_CHANGE_BATCH_SIZE", "1000"))
+SNAPSHOT_REWRITE_CHANGES = int(os.getenv("VENUE_SNAPSHOT_REWRITE_CHANGES", "10000"))
+REEMBED_CHUNK_SIZE = int(os.getenv("REEMBED_CHUNK_SIZE", "2048"))  # Venues read, encoded and written per step
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "256"))  # Texts per model call
+REEMBED_PROCESSES = int(os.getenv("REEMBED_PROCESSES", "2"))
+REEMBED_CHECKPOINT = os.getenv("REEMBED_CHECKPOINT", "reembed.checkpoint")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Required in X-Admin-Token by /admin/...; unset disables them
+
+# With worker processes the model is only loaded there, not in the server
+EMBEDDING_NAME = embedder_name(EMBEDDING_MODEL)  # Which vectors this model and backend produce
+embedding_model = load_embedder(EMBEDDING_MODEL) if EMBEDDING_WORKERS == 0 else None
+embedding_pool = EmbeddingWorkerPool(EMBEDDING_MODEL, EMBEDDING_WORKERS) if EMBEDDING_WORKERS > 0 else None
+
 def createConnection():
     try:
         host = os.getenv('DB_HOST')
@@ -50,9 +101,23 @@ def createConnection():
         return None, None 
 
 # SQLAlchemy engine setup
+engine = None
+
+def get_engine():
+    # One engine (and connection pool) per process, shared by requests and the change poller
+    global engine
+    if engine is None:
+        connection, DATABASE_URL = createConnection()
+        if connection is not None:
+            connection.close()
+        engine = create_engine(DATABASE_URL, pool_pre_ping=True)  # Corrected here with create_engine import
+    return engine
+
+def open_session():
+    return sessionmaker(bind=get_engine())()
+
 def get_db():
-    connection, DATABASE_URL = createConnection()
-    db = sessionmaker(bind=create_engine(DATABASE_URL))()  # Corrected here with create_engine import
+    db = open_session()
     try:
         yield db
     finally:
@@ -73,24 +138,357 @@ class Venues(Base):
     style = Column(String(100))
     keywords = Column(Text)
     photo = Column(String(255))  # Image URL for the venue
+    style_tokens = Column(JSON)  # Normalized style terms, derived from style on write
+    keyword_tokens = Column(JSON)  # Normalized keyword terms, derived from keywords on write
+    updated_at = Column(DateTime, index=True)
+    row_version = Column(BigInteger, nullable=False, default=0, index=True)  # Change-feed position of the last write
 
+# Columns read into the in-memory index: the public fields plus pre-tokenized terms
+INDEX_COLUMNS = [getattr(Venues, field) for field in VENUE_FIELDS + TOKEN_FIELDS]
 
-from sentence_transformers import util
+class VenueTombstones(Base):
+    # Deleted venue ids, kept so change-feed readers can drop them from their copies
+    __tablename__ = 'venue_tombstones'
+    id = Column(String(12), primary_key=True)
+    row_version = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime)
 
-def calculate_weighted_match_score(user_input, venue, model):
-    weights = {
-        'capacity': 0.3,
-        'city': 0.2,
-        'style': 0.3,
-        'keywords': 0.2,  # Fine-tune this weight if necessary
-    }
+class VenueEmbeddings(Base):
+    # Venue vectors written by the re-embedding job, so an index rebuild only runs the
+    # model for venues changed since (venue_version is the venue's row_version then)
+    __tablename__ = 'venue_embeddings'
+    venue_id = Column(String(12), ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    model = Column(String(100), nullable=False)
+    venue_version = Column(BigInteger, nullable=False)
+    vector = Column(LargeBinary, nullable=False)  # float32, unit length
+    updated_at = Column(DateTime)
+
+class VenueNeighbours(Base):
+    # Precomputed "similar venues": the SIMILAR_K best neighbours of each venue, written by
+    # build_similar_venues and patched on writes (venue_version is the venue's row_version
+    # when its list was computed). A venue with no neighbours at all gets one row pointing
+    # at itself at position -1, so its empty list is stored rather than missing.
+    __tablename__ = 'venue_neighbours'
+    venue_id = Column(String(12), ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    neighbour_id = Column(String(12), ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True, index=True)
+    position = Column(Integer, nullable=False)  # 0 for the most similar
+    score = Column(Float, nullable=False)
+    venue_version = Column(BigInteger, nullable=False)
+
+class VenueChangeSequence(Base):
+    # Single-row counter handing out row_version values
+    __tablename__ = 'venue_change_sequence'
+    id = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+# Normalized style/keyword terms. Venues.style and Venues.keywords stay the source of
+# truth; these tables are derived from them on every write so lookups by term are
+# indexed joins instead of splitting strings for every row.
+TERM_MAX_LENGTH = 191  # Longest utf8mb4 string MySQL can put in a unique index
+TERM_COLLATION = "utf8mb4_bin"
+
+class VenueTerms(Base):
+    __tablename__ = 'venue_terms'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Binary collation: MySQL's default one treats "cafe" and "café" as the same term
+    term = Column(String(TERM_MAX_LENGTH).with_variant(String(TERM_MAX_LENGTH, collation=TERM_COLLATION), "mysql"), nullable=False, unique=True)
+
+class VenueStyles(Base):
+    __tablename__ = 'venue_styles'
+    venue_id = Column(String(12), ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    term_id = Column(Integer, ForeignKey('venue_terms.id'), primary_key=True)
+    __table_args__ = (Index('ix_venue_styles_term_venue', 'term_id', 'venue_id'),)
+
+class VenueKeywords(Base):
+    __tablename__ = 'venue_keywords'
+    venue_id = Column(String(12), ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    term_id = Column(Integer, ForeignKey('venue_terms.id'), primary_key=True)
+    __table_args__ = (Index('ix_venue_keywords_term_venue', 'term_id', 'venue_id'),)
+
+TERM_TABLES = {"style": VenueStyles, "keywords": VenueKeywords}
+
+def tokenize_venue(venue):
+    # Ingest-time normalization; works on ORM objects and on plain row dicts
+    if isinstance(venue, dict):
+        venue["style_tokens"] = normalize_terms(venue.get("style"))
+        venue["keyword_tokens"] = normalize_terms(venue.get("keywords"))
+    else:
+        venue.style_tokens = normalize_terms(venue.style)
+        venue.keyword_tokens = normalize_terms(venue.keywords)
+    return venue
+
+
+def next_row_version(db):
+    # The UPDATE holds the counter's row lock until commit, so writers commit in version
+    # order and a reader that has seen version N has also seen every version below it
+    sequence = VenueChangeSequence.__table__
+    db.execute(sequence.update().where(sequence.c.id == 1).values(value=sequence.c.value + 1))
+    return db.execute(sequence.select().with_only_columns(sequence.c.value).where(sequence.c.id == 1)).scalar_one()
+
+def current_row_version(db):
+    return db.query(VenueChangeSequence.value).filter(VenueChangeSequence.id == 1).scalar() or 0
+
+@event.listens_for(Session, "before_flush")
+def stamp_venue_changes(db, flush_context, instances):
+    # Every ORM write to venues gets a fresh row_version (one per flush) and deletes leave
+    # a tombstone. Bulk SQL statements bypass this hook and must set row_version themselves.
+    new = [obj for obj in db.new if isinstance(obj, Venues)]
+    dirty = [obj for obj in db.dirty if isinstance(obj, Venues) and db.is_modified(obj)]
+    deleted = [obj for obj in db.deleted if isinstance(obj, Venues)]
+    if not (new or dirty or deleted):
+        return
+
+    version = next_row_version(db)
+    now = datetime.utcnow()
+    changed_terms = [venue for venue in dirty if any(inspect(venue).attrs[field].history.has_changes() for field in TERM_TABLES)]
+    for venue in new + changed_terms:
+        tokenize_venue(venue)
+    for venue in new + dirty:
+        venue.row_version = version
+        venue.updated_at = now
+    with db.no_autoflush:
+        if new:
+            db.query(VenueTombstones).filter(VenueTombstones.id.in_([v.id for v in new])).delete(synchronize_session=False)
+        for venue in deleted:
+            db.merge(VenueTombstones(id=venue.id, row_version=version, deleted_at=now))
+        if deleted:
+            delete_venue_terms(db, [venue.id for venue in deleted])
+
+    # Term rows reference the venue, so they are written once the venue row exists
+    db.info.setdefault("venue_term_updates", []).extend(new + changed_terms)
+
+@event.listens_for(Session, "after_flush")
+def write_venue_terms(db, flush_context):
+    venues = db.info.pop("venue_term_updates", None)
+    if venues:
+        sync_venue_terms(db, [(venue.id, venue.style_tokens, venue.keyword_tokens) for venue in venues])
+
+def term_ids(db, terms):
+    # Map terms to vocabulary ids, adding the ones not seen before
+    terms = {term[:TERM_MAX_LENGTH] for term in terms}
+    if not terms:
+        return {}
+    table = VenueTerms.__table__
+    known = dict(db.execute(select(table.c.term, table.c.id).where(table.c.term.in_(terms))).all())
+    missing = terms - known.keys()
+    if missing:
+        # Concurrent writers may add the same term; IGNORE makes that a no-op
+        db.execute(insert(table).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite"), [{"term": term} for term in missing])
+        known.update(db.execute(select(table.c.term, table.c.id).where(table.c.term.in_(missing))).all())
+    return known
+
+def delete_venue_terms(db, venue_ids):
+    for model in TERM_TABLES.values():
+        db.execute(model.__table__.delete().where(model.__table__.c.venue_id.in_(venue_ids)))
+
+def sync_venue_terms(db, venues):
+    # Replace the term rows of (id, style_tokens, keyword_tokens) tuples, a whole batch per statement
+    if not venues:
+        return
+    delete_venue_terms(db, [venue_id for venue_id, style_tokens, keyword_tokens in venues])
+    parsed = [(venue_id, {"style": style_tokens or [], "keywords": keyword_tokens or []}) for venue_id, style_tokens, keyword_tokens in venues]
+    ids = term_ids(db, [term for venue_id, fields in parsed for terms in fields.values() for term in terms])
+    for field, model in TERM_TABLES.items():
+        rows = {(venue_id, ids[term[:TERM_MAX_LENGTH]]) for venue_id, fields in parsed for term in fields[field]}
+        if rows:
+            db.execute(insert(model.__table__), [{"venue_id": venue_id, "term_id": term_id} for venue_id, term_id in rows])
+
+def venues_with_term(field, term):
+    # Indexed semi-join: ids of venues whose style/keywords contain the normalized term
+    model = TERM_TABLES[field]
+    return select(model.venue_id).join(VenueTerms, VenueTerms.id == model.term_id).where(VenueTerms.term == term)
+
+
+venue_index = None
+changes_since_snapshot = 0
+venue_sync_lock = threading.RLock()  # The poller, bulk ingest and write endpoints all sync the index; re-entered by the first load
+search_cache = SearchResultCache(SEARCH_CACHE_SIZE)
+query_embedding_cache = EmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_DIR, EMBEDDING_NAME)
+query_batcher = MicroBatcher(lambda texts: encode_queries(texts), QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WAIT_MS / 1000)
+
+def encode_texts(texts, **options):
+    if embedding_pool is not None:
+        return embedding_pool.encode(texts, normalize_embeddings=True, **options)
+    return embedding_model.encode(texts, normalize_embeddings=True, **options)
+
+def embed_venues(venues):
+    return encode_texts([venue_text(v) for v in venues], batch_size=64)
+
+def current_embedding():
+    # Stored vectors from this model for the venue as it is now
+    return and_(VenueEmbeddings.model == EMBEDDING_NAME, VenueEmbeddings.venue_version == Venues.row_version)
+
+def load_venue_embeddings(db, venues):
+    # Embedding matrix for `venues`: stored vectors where they are current, the model
+    # only for the rest
+    stored = {}
+    query = db.query(VenueEmbeddings.venue_id, VenueEmbeddings.vector).join(Venues, Venues.id == VenueEmbeddings.venue_id).filter(current_embedding())
+    for venue_id, vector in query.yield_per(10000):
+        stored[venue_id] = np.frombuffer(vector, dtype=np.float32)
+    vectors = [stored.get(venue.id) for venue in venues]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        for i, vector in zip(missing, embed_venues([venues[i] for i in missing])):
+            vectors[i] = vector
+    return np.vstack(vectors)
+
+def save_venue_snapshot(index):
+    global changes_since_snapshot
+    try:
+        write_snapshot(index, SNAPSHOT_PATH)
+        changes_since_snapshot = 0
+    except OSError as e:
+        print(f"Error writing venue snapshot: {e}")
+
+def rebuild_venue_index(db):
+    # Full scan of the venues table, then persist it so the next cold start can skip this.
+    # The watermark is read first; changes racing the scan are simply re-applied by the poller.
+    global venue_index
+    watermark = current_row_version(db)
+    venues = db.query(*INDEX_COLUMNS).all()
+
+    embeddings = None
+    if INDEX_EMBEDDINGS:
+        # An empty table still gets an (empty) store, sized by encoding a probe text, so
+        # venues added later are embedded as they are synced
+        embeddings = EmbeddingStore.build(load_venue_embeddings(db, venues) if venues else encode_texts(["venue"])[:0])
+
+    venue_index = VenueIndex.from_rows(venues, embeddings=embeddings, meta={"watermark": watermark, "embedding_model": EMBEDDING_NAME})
+    search_cache.clear()
+    save_venue_snapshot(venue_index)
+    return venue_index
+
+def get_venue_index(db):
+    # Prefer the memory-mapped snapshot (caught up through the change feed),
+    # fall back to a DB scan if it is missing or stale. Loaded under the sync lock so a
+    # request arriving during the startup sync waits for it instead of loading another copy.
+    global venue_index
+    if venue_index is None:
+        with venue_sync_lock:
+            if venue_index is None:
+                snapshot = load_snapshot(SNAPSHOT_PATH)
+                if snapshot_is_stale(snapshot, SNAPSHOT_MAX_AGE, INDEX_EMBEDDINGS) or snapshot.meta.get("embedding_model", EMBEDDING_NAME) != EMBEDDING_NAME:
+                    rebuild_venue_index(db)
+                else:
+                    venue_index = snapshot
+                    _sync_venue_index(db)
+    return venue_index
+
+def page_changes(db, model, columns, since, until):
+    # Keyset pagination over (row_version, id), so one large flush sharing a version still pages
+    last = None
+    while True:
+        query = db.query(*columns).filter(model.row_version > since, model.row_version <= until)
+        if last is not None:
+            query = query.filter(or_(model.row_version > last[0], and_(model.row_version == last[0], model.id > last[1])))
+        page = query.order_by(model.row_version, model.id).limit(CHANGE_BATCH_SIZE).all()
+        if not page:
+            return
+        yield page
+        last = (page[-1].row_version, page[-1].id)
+
+def sync_venue_index(db):
+    with venue_sync_lock:
+        return _sync_venue_index(db)
+
+def changed_cities(index, venues):
+    # Normalized cities a change touches: the new values plus whatever the index held before
+    cities = {venue.city for venue in venues}
+    for venue in venues:
+        old = index.get(venue.id)
+        if old is not None:
+            cities.add(old.city)
+    return {city.strip().lower() for city in cities if city}
+
+def _sync_venue_index(db):
+    # Apply venues written or deleted since the index's watermark: O(changes), not O(table).
+    # This is the one path that mutates search state, whether the change came from the
+    # write endpoints, a bulk ingest or another process picked up by the poller.
+    global changes_since_snapshot
+    index = get_venue_index(db)
+    since = index.meta["watermark"]
+    until = current_row_version(db)
+    if until <= since:
+        return 0
+
+    applied = 0
+    for page in page_changes(db, Venues, INDEX_COLUMNS + [Venues.row_version], since, until):
+        embeddings = embed_venues(page) if index.embeddings is not None else None
+        cities = changed_cities(index, page)
+        index.apply_changes(page, embeddings=embeddings)
+        search_cache.invalidate_cities(cities)
+        applied += len(page)
+    for page in page_changes(db, VenueTombstones, [VenueTombstones.id, VenueTombstones.row_version], since, until):
+        cities = changed_cities(index, [venue for venue in (index.get(t.id) for t in page) if venue is not None])
+        index.apply_changes([], deleted_ids=[t.id for t in page])
+        search_cache.invalidate_cities(cities)
+        applied += len(page)
+    index.meta["watermark"] = until
+
+    changes_since_snapshot += applied
+    if changes_since_snapshot >= SNAPSHOT_REWRITE_CHANGES:
+        save_venue_snapshot(index)
+    return applied
+
+def run_venue_sync():
+    db = open_session()
+    try:
+        return sync_venue_index(db)
+    finally:
+        db.close()
+
+async def poll_venue_changes():
+    while True:
+        await asyncio.sleep(CHANGE_POLL_INTERVAL)
+        try:
+            await asyncio.to_thread(run_venue_sync)
+        except Exception as e:
+            print(f"Error syncing venue index: {e}")
+
+venue_poller = None
+
+@app.on_event("startup")
+async def warm_venue_index():
+    global venue_poller
+    if embedding_pool is not None:
+        embedding_pool.start()  # Workers load the model while the index warms up
+    try:
+        await asyncio.to_thread(run_venue_sync)
+    except Exception as e:
+        print(f"Error loading venue index: {e}")
+    if CHANGE_POLL_INTERVAL > 0:
+        venue_poller = asyncio.create_task(poll_venue_changes())
+
+@app.on_event("shutdown")
+async def stop_embedding_workers():
+    if embedding_pool is not None:
+        await asyncio.to_thread(embedding_pool.close)
+
+
+MATCH_WEIGHTS = {
+    'capacity': 0.3,
+    'city': 0.2,
+    'style': 0.3,
+    'keywords': 0.2,  # Fine-tune this weight if necessary
+}
+
+# Signals behind "similar venues" (see similar.py)
+SIMILAR_WEIGHTS = {
+    'embedding': 0.4,
+    'capacity': 0.2,
+    'city': 0.2,
+    'style': 0.2,
+}
+
+def calculate_weighted_match_score(user_input, venue, model, style_similarity=None, keyword_masks=None):
+    weights = MATCH_WEIGHTS
     match_score = 0
     max_score = sum(weights.values())
 
     # City Scoring
     city_similarity = 0
-    if user_input.get('city') and venue.city:
-        if user_input['city'].strip().lower() == venue.city.strip().lower():
+    if user_input.get('city_term') and venue.city:
+        if user_input['city_term'] == normalize_city(venue.city):
             city_similarity = 1  # Exact city match
         else:
             city_similarity = 0
@@ -123,20 +521,32 @@ def calculate_weighted_match_score(user_input, venue, model):
             print("Capacity input format is invalid:", user_input['capacity'])
 
     # Style Scoring (Updated to support partial matches)
-    if user_input.get('style') and venue.style:
-        user_styles = user_input['style'].lower().split(',')
-        venue_styles = venue.style.lower().split(',')
-        
+    # Both sides are pre-normalized: venue tokens at write time, user terms once per query.
+    # Searches pass style_similarity precomputed for every venue from the style bitsets.
+    if style_similarity is not None:
+        match_score += style_similarity * weights['style']
+    elif user_input.get('style_terms') and venue.style_tokens:
+        user_styles = user_input['style_terms']
+        venue_styles = venue.style_tokens
+
         # Matching substrings of user input in venue styles
         style_similarity = sum(1 for user_style in user_styles if any(user_style in venue_style for venue_style in venue_styles)) / len(user_styles)
 
         match_score += style_similarity * weights['style']
 
     # Keyword Scoring (Updated to support partial matches)
-    if user_input.get('keywords') and venue.keywords:
-        user_keywords = user_input['keywords'].lower().split(',')
-        venue_keywords = venue.keywords.lower().split(',')
-        
+    # Searches pass keyword_masks: for each keyword term in the catalog, a bitmask of the
+    # user terms it contains, so a venue's matches are the OR of its terms' masks.
+    if keyword_masks is not None:
+        if user_input.get('keyword_terms') and venue.keyword_tokens:
+            matched = 0
+            for venue_keyword in venue.keyword_tokens:
+                matched |= keyword_masks.get(venue_keyword, 0)
+            match_score += bin(matched).count("1") / len(user_input['keyword_terms']) * weights['keywords']
+    elif user_input.get('keyword_terms') and venue.keyword_tokens:
+        user_keywords = user_input['keyword_terms']
+        venue_keywords = venue.keyword_tokens
+
         # Matching substrings of user input in venue keywords
         keyword_similarity = sum(1 for user_keyword in user_keywords if any(user_keyword in venue_keyword for venue_keyword in venue_keywords)) / len(user_keywords)
 
@@ -150,10 +560,84 @@ def calculate_weighted_match_score(user_input, venue, model):
 
 
 
+def parse_capacity_range(capacity):
+    # "250" -> (250, 250), "250+" -> (250, inf); raises ValueError like the scorer does
+    if '+' in capacity:
+        return int(capacity.replace('+', '').strip()), float('inf')
+    return int(capacity), int(capacity)
+
+def match_score_bounds(user_input, capacities, style_scores):
+    # Upper bound of calculate_weighted_match_score for each venue, from the components
+    # that are cheap to get for all venues at once: capacity from the capacity column,
+    # city (every candidate already passed the city filter), precomputed style scores,
+    # and keywords assumed to match fully
+    weights = MATCH_WEIGHTS
+    capacity_scores = np.zeros(len(capacities))
+    if user_input.get('capacity'):
+        try:
+            capacity_scores = capacity_similarity(capacities, *parse_capacity_range(user_input['capacity']))
+        except ValueError:
+            pass
+    bound = capacity_scores * weights['capacity'] + style_scores * weights['style']
+    if user_input.get('city_term'):
+        bound = bound + weights['city']
+    if user_input.get('keyword_terms'):
+        bound = bound + weights['keywords']
+    return np.minimum(bound / sum(weights.values()) * 1.5, 1.0) + 1e-9  # Slack for rounding differences
+
+def top_matches(index, positions, user_input, style_scores, keyword_masks, k=15):
+    # The k best (position, venue, match_score) triples, exactly as scoring every venue and sorting
+    # by rounded score (ties in position order) would return them. Venues are visited
+    # by decreasing upper bound and fully scored only until the bound of the next one
+    # can no longer beat the k-th best, so most venues never have their keywords scored
+    # or a row built.
+    capacities = np.asarray(index.columns["capacity"])[positions]
+    bounds = match_score_bounds(user_input, capacities, style_scores[positions])
+    best = []  # Min-heap of (rounded score, -position, venue, score)
+    for i in np.argsort(-bounds, kind="stable"):
+        if len(best) == k and round(bounds[i] * 100, 2) < best[0][0]:
+            break
+        pos = int(positions[i])
+        venue = index.row(pos)
+        score = calculate_weighted_match_score(user_input, venue, embedding_model, style_similarity=style_scores[pos], keyword_masks=keyword_masks)
+        entry = (round(score * 100, 2), -pos, venue, score)
+        if len(best) < k:
+            heapq.heappush(best, entry)
+        elif entry[:2] > best[0][:2]:
+            heapq.heapreplace(best, entry)
+    best.sort(key=lambda entry: entry[:2], reverse=True)
+    return [(-entry[1], entry[2], entry[3]) for entry in best]
+
+def rerank_semantic(index, matches, query, k=15):
+    # Reorder (position, venue, match_score) candidates by embedding similarity to the
+    # query; equally similar venues keep their lexical order
+    if not matches:
+        return []
+    similarities = index.embeddings.similarities(np.array([pos for pos, venue, score in matches]), query)
+    order = sorted(range(len(matches)), key=lambda i: -similarities[i])[:k]
+    return [(matches[i][1], max(float(similarities[i]), 0.0)) for i in order]
+
+
+def venue_to_dict(v):
+    return {
+        "id": v.id,
+        "name": v.name,
+        "city": v.city,
+        "zipcode": v.zipcode,
+        "phone": v.phone,
+        "email": v.email,
+        "capacity": v.capacity,
+        "style": v.style,
+        "keywords": v.keywords,
+        "inquiry_url": v.inquiry_url,
+        "photo": v.photo
+    }
+
+
 @app.get("/venues/")  # Get all venues with pagination
-async def get_all_venues(db: Session = Depends(get_db)):
+async def get_all_venues(style: str = None, keywords: str = None, db: Session = Depends(get_db)):
     # Fetch only necessary columns excluding 'photo'
-    venues = db.query(
+    query = db.query(
         Venues.id,
         Venues.name,
         Venues.city,
@@ -165,7 +649,13 @@ async def get_all_venues(db: Session = Depends(get_db)):
         Venues.keywords,
         Venues.inquiry_url,
         Venues.photo
-    ).all()
+    )
+
+    # Optional filters: venues having every listed style / keyword term
+    for field, value in (("style", style), ("keywords", keywords)):
+        for term in normalize_terms(value):
+            query = query.filter(Venues.id.in_(venues_with_term(field, term)))
+    venues = query.all()
 
     # Prepare the response with necessary venue details
     response = [{
@@ -185,61 +675,807 @@ async def get_all_venues(db: Session = Depends(get_db)):
     return response
 
 
+SEARCH_RANKINGS = ("weighted", "bm25", "semantic", "hybrid")
+
+def search_query_text(user_input):
+    # What a semantic search embeds: the normalized style, keyword and city terms
+    parts = (", ".join(user_input['style_terms']), ", ".join(user_input['keyword_terms']), user_input['city_term'])
+    return ". ".join(part for part in parts if part)
+
+def encode_queries(texts):
+    return encode_texts(texts, batch_size=len(texts))
+
+async def embed_query(text):
+    # Cached vector if there is one, otherwise encoded together with whatever other
+    # queries arrive within the batching window
+    vector = query_embedding_cache.lookup(text)
+    if vector is None:
+        vector = query_embedding_cache.store(text, await query_batcher.submit(text))
+    return vector
+
+def require_embeddings(index, ranking):
+    if index.embeddings is None:
+        raise HTTPException(status_code=400, detail=f"{ranking} ranking needs venue embeddings (VENUE_INDEX_EMBEDDINGS=1)")
+
+def search_result(venue, match_score):
+    return {
+        "id": venue.id,
+        "name": venue.name,
+        "city": venue.city,
+        "zipcode": venue.zipcode,
+        "phone": venue.phone,
+        "email": venue.email,
+        "capacity": venue.capacity,
+        "style": venue.style,
+        "keywords": venue.keywords,
+        "inquiry_url": venue.inquiry_url,
+        "match_score": round(match_score * 100, 2),
+        "photo": venue.photo  # Directly include the photo URL
+    }
+
+
+def resolve_terms(index, field, terms, corrections):
+    # Terms as search will match them, recording each substitution in corrections[field]
+    resolved = []
+    for term in terms:
+        match = index.resolve_term(field, term)
+        if match != term:
+            corrections.setdefault(field, {})[term] = match
+        resolved.append(match)
+    return list(dict.fromkeys(resolved))
+
 @app.get("/venues/search")  # Search venues based on user input
 async def search_venues(
-    capacity: str = None, city: str = None, style: str = None, keywords: str = None, db: Session = Depends(get_db)
+    response: Response, capacity: str = None, city: str = None, style: str = None, keywords: str = None, ranking: str = "weighted", db: Session = Depends(get_db)
 ):
+    if ranking not in SEARCH_RANKINGS:
+        raise HTTPException(status_code=400, detail=f"ranking must be one of {', '.join(SEARCH_RANKINGS)}")
+
     user_input = {
         'capacity': capacity,
         'city': city,
         'style': style,
         'keywords': keywords,
+        'city_term': normalize_city(city),
+        'style_terms': normalize_terms(style),
+        'keyword_terms': normalize_terms(keywords),
     }
 
-    # Fetch venues
-    venues = db.query(
-        Venues.id,
-        Venues.name,
-        Venues.city,
-        Venues.zipcode,
-        Venues.phone,
-        Venues.email,
-        Venues.capacity,
-        Venues.style,
-        Venues.keywords,
-        Venues.inquiry_url,
-        Venues.photo  # Keep photo URL in the database
-    ).all()
+    # Fetch venues from the in-memory index. The cache generation is read first: if a
+    # change is applied while this search runs, its result is not cached.
+    generation = search_cache.generation
+    index = get_venue_index(db)
+
+    # Misspelled terms ("chicgo") are replaced by the closest known city/style/keyword
+    # rather than matching nothing. The substitutions are reported in the
+    # X-Search-Corrections header, e.g. {"city": {"chicgo": "chicago"}}.
+    corrections = {}
+    with index.reading():
+        if user_input['city_term']:
+            user_input['city_term'] = resolve_terms(index, "city", [user_input['city_term']], corrections)[0]
+        user_input['style_terms'] = resolve_terms(index, "style", user_input['style_terms'], corrections)
+        user_input['keyword_terms'] = resolve_terms(index, "keywords", user_input['keyword_terms'], corrections)
+    if corrections:
+        response.headers["X-Search-Corrections"] = json.dumps(corrections)
+
+    # City goes first and ranking last in the key so writes can invalidate by them
+    cache_key = (
+        user_input['city_term'],
+        capacity or None,
+        tuple(user_input['style_terms']),
+        tuple(user_input['keyword_terms']),
+        ranking,
+    )
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Semantic and hybrid rankings embed the query first, so the index isn't held across
+    # the wait for the model
+    query = None
+    if ranking in ("semantic", "hybrid"):
+        require_embeddings(index, ranking)
+        query_text = search_query_text(user_input)
+        if query_text:
+            query = await embed_query(query_text)
+
+    with index.reading():
+        results = rank_venues(index, user_input, ranking, query)
+    search_cache.put(cache_key, results, generation)
+    return results
+
+def rank_venues(index, user_input, ranking, query):
+    # BM25 ranking: venues ranked by their name and keywords against the keyword terms,
+    # top 15 straight from the inverted index (within the city filter, if any). Scores
+    # are scaled so the best hit is 100.
+    if ranking == "bm25" and user_input['keyword_terms']:
+        allowed = index.filter_bitmap({"city": [user_input['city_term']]}) if user_input['city_term'] else None
+        hits = index.bm25.top_k(query_words(user_input['keyword_terms']), 15, allowed)
+        return [search_result(index.row(pos), score / hits[0][1]) for pos, score in hits]
+
+    # Semantic ranking: venues whose embeddings are closest to the query's, within the
+    # city filter if any. Large catalogs go through the approximate (IVF) index.
+    if ranking == "semantic" and query is not None:
+        allowed = index.filter_bitmap({"city": [user_input['city_term']]}).to_array() if user_input['city_term'] else None
+        found, similarities = index.nearest(query, 15, allowed)
+        return [search_result(index.row(int(pos)), max(float(similarity), 0.0)) for pos, similarity in zip(found, similarities)]
 
     # Filter venues by exact city match (if city is provided)
+    if user_input['city_term']:
+        positions = index.filter_bitmap({"city": [user_input['city_term']]}).to_array()
+    else:
+        positions = index.positions()
+
+    # Style similarity for every venue at once: AND each venue's style bitset with the
+    # vocabulary entries matching each user term
+    style_scores = index.style_masks.similarity(user_input['style_terms'], len(index))
+
+    # Keyword terms are matched against the keyword vocabulary once per query
+    keyword_masks = index.keyword_term_masks(user_input['keyword_terms']) if user_input['keyword_terms'] else {}
+
+    # Hybrid ranking: the weighted match picks the best HYBRID_CANDIDATES venues cheaply,
+    # and only those are reordered by embedding similarity to the query
+    if ranking == "hybrid" and query is not None:
+        matches = top_matches(index, positions, user_input, style_scores, keyword_masks, max(HYBRID_CANDIDATES, 15))
+        return [search_result(venue, similarity) for venue, similarity in rerank_semantic(index, matches, query)]
+
+    # Return the top 15 venues by match score, pruning venues that cannot make it
+    return [search_result(venue, match_score) for pos, venue, match_score in top_matches(index, positions, user_input, style_scores, keyword_masks, 15)]
+
+
+@app.get("/metrics")  # Cache hit rates and query embedding batching
+async def get_metrics():
+    return {
+        "search_cache": search_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_batching": query_batcher.stats(),
+        "embedding_workers": embedding_pool.stats() if embedding_pool is not None else [],
+    }
+
+
+@app.get("/health")  # Liveness of the embedding workers; 503 until one of them answers
+async def get_health():
+    if embedding_pool is None:
+        return {"status": "ok", "embedding_workers": []}
+    workers = await asyncio.to_thread(embedding_pool.health)
+    if not any(worker["status"] in ("ok", "busy") for worker in workers):
+        raise HTTPException(status_code=503, detail={"status": "unavailable", "embedding_workers": workers})
+    return {"status": "ok", "embedding_workers": workers}
+
+
+class VenueBatchRequest(BaseModel):
+    ids: list[str]
+
+def lookup_venues(db, venue_ids):
+    # Serve from the id-keyed index; anything it doesn't have yet (e.g. written since
+    # the last change poll) is fetched with a single WHERE id IN (...) query
+    index = get_venue_index(db)
+    found = {}
+    misses = []
+    with index.reading():
+        for venue_id in venue_ids:
+            venue = index.get(venue_id)
+            if venue is not None:
+                found[venue_id] = venue
+            else:
+                misses.append(venue_id)
+    if misses:
+        columns = [getattr(Venues, field) for field in VENUE_FIELDS]
+        for venue in db.query(*columns).filter(Venues.id.in_(misses)).all():
+            found[venue.id] = venue
+    return found
+
+
+# Sync tokens are an opaque encoding of the (row_version, id) of the last change a client saw
+def encode_sync_token(row_version, venue_id):
+    return base64.urlsafe_b64encode(f"{row_version}:{venue_id}".encode()).decode().rstrip("=")
+
+def decode_sync_token(token):
+    if not token:
+        return -1, ""  # Start of the feed, pre-migration rows have row_version 0
+    try:
+        row_version, venue_id = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().split(":", 1)
+        return int(row_version), venue_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid sync token: {token}")
+
+def changes_after(db, model, columns, position, limit):
+    row_version, venue_id = position
+    return db.query(*columns).filter(
+        or_(model.row_version > row_version, and_(model.row_version == row_version, model.id > venue_id))
+    ).order_by(model.row_version, model.id).limit(limit).all()
+
+
+@app.get("/venues/changes")  # Venues upserted or deleted since a sync token
+async def get_venue_changes(since: str = None, limit: int = Query(500, ge=1, le=5000), db: Session = Depends(get_db)):
+    try:
+        position = decode_sync_token(since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Live rows and tombstones never share an id, so both tables together form one
+    # feed ordered by (row_version, id). Each side is read through its row_version
+    # index and the two pages are merged here. One row past the limit is read from each
+    # side so has_more is right even when all of them come from one table.
+    columns = [getattr(Venues, field) for field in VENUE_FIELDS] + [Venues.row_version]
+    upserted = changes_after(db, Venues, columns, position, limit + 1)
+    deleted = changes_after(db, VenueTombstones, [VenueTombstones.id, VenueTombstones.row_version], position, limit + 1)
+    changes = sorted([(v.row_version, v.id, v, False) for v in upserted] + [(t.row_version, t.id, t, True) for t in deleted], key=lambda c: (c[0], c[1]))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    next_token = encode_sync_token(changes[-1][0], changes[-1][1]) if changes else (since or encode_sync_token(*position))
+    return {
+        "upserted": [venue_to_dict(c[2]) for c in changes if not c[3]],
+        "deleted": [c[1] for c in changes if c[3]],
+        "next_token": next_token,
+        "has_more": has_more,
+    }
+
+
+@app.get("/venues/facets")  # Venue counts per city, style and capacity bucket for a filter set
+async def get_venue_facets(
+    city: str = None, style: str = None, keywords: str = None, capacity: str = None, db: Session = Depends(get_db)
+):
+    # Each parameter takes a comma-separated list; values of one parameter are ORed and
+    # parameters are ANDed. capacity takes bucket labels such as "100-249" or "2500+".
+    filters = {}
     if city:
-        venues = [venue for venue in venues if venue.city.strip().lower() == city.strip().lower()]
+        filters["city"] = city.split(",")
+    if style:
+        filters["style"] = [style]
+    if keywords:
+        filters["keywords"] = [keywords]
+    if capacity:
+        filters["capacity"] = [label.strip() for label in capacity.split(",")]
+
+    # One bitmap intersection for the filters, then one pass over the matching rows
+    # for all three facets
+    index = get_venue_index(db)
+    with index.reading():
+        positions = index.filter_bitmap(filters).to_array()
+        facets = index.facet_counts(positions)
+    for field in ("city", "style"):  # Capacity buckets stay in range order
+        facets[field].sort(key=lambda value: (-value["count"], value["value"]))
+    return {"total": len(positions), "facets": facets}
+
+
+@app.get("/venues/suggest")  # Typeahead suggestions for city, style or keyword terms
+async def suggest_venue_terms(field: str, prefix: str = "", limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+    if field not in ("city", "style", "keywords"):
+        raise HTTPException(status_code=400, detail="field must be one of city, style, keywords")
+
+    # Same lowercasing and whitespace folding as the stored terms; no stemming, since
+    # a partial word would be stemmed differently from the word it is the start of
+    prefix = normalize_term(prefix, stem=False) if prefix.strip() else ""
+    index = get_venue_index(db)
+    with index.reading():
+        suggestions = index.suggest(field, prefix, limit)
+    return [{"value": term, "count": count} for term, count in suggestions]
+
+
+
+class VenueBase(BaseModel):
+    @field_validator("*", mode="before")
+    @classmethod
+    def blank_to_none(cls, value):
+        # Spreadsheet exports leave empty cells as ""
+        if isinstance(value, str) and not value.strip():
+            return None
+        return value
+
+    @field_validator("style", "keywords", mode="before", check_fields=False)
+    @classmethod
+    def join_list(cls, value):
+        # Accept ["Theater", "Performance Space"] as well as the stored comma-separated form
+        if isinstance(value, list):
+            return ",".join(str(item) for item in value)
+        return value
+
+class VenueFields(VenueBase):
+    name: str = Field(min_length=1, max_length=255)
+    city: Optional[str] = Field(None, max_length=50)
+    zipcode: Optional[int] = None
+    phone: Optional[int] = None
+    email: Optional[str] = Field(None, max_length=100)
+    inquiry_url: Optional[str] = Field(None, max_length=100)
+    capacity: Optional[int] = Field(None, ge=0)
+    style: Optional[str] = Field(None, max_length=100)
+    keywords: Optional[str] = None
+    photo: Optional[str] = Field(None, max_length=255)
+
+class VenueIn(VenueFields):
+    id: str = Field(min_length=1, max_length=12)
+
+class VenuePatch(VenueBase):
+    # Only the fields present in the request body are changed
+    name: Optional[str] = Field(None, min_length=1, max_length=255)
+    city: Optional[str] = Field(None, max_length=50)
+    zipcode: Optional[int] = None
+    phone: Optional[int] = None
+    email: Optional[str] = Field(None, max_length=100)
+    inquiry_url: Optional[str] = Field(None, max_length=100)
+    capacity: Optional[int] = Field(None, ge=0)
+    style: Optional[str] = Field(None, max_length=100)
+    keywords: Optional[str] = None
+    photo: Optional[str] = Field(None, max_length=255)
+
+
+class MalformedRecord:
+    # A JSON Lines line that isn't valid JSON, passed on so it is rejected like a record
+    # failing validation instead of ending the ingest
+    def __init__(self, line, error):
+        self.line = line
+        self.error = error
+
+def read_venue_records(stream, fmt):
+    # Stream dicts out of a CSV (header row = column names) or JSON Lines text stream
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield MalformedRecord(line_number, e)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+def upsert_venue_batch(db, venues):
+    # One multi-row statement per batch. The statement bypasses the ORM flush hook,
+    # so the batch is stamped with a single row_version here instead.
+    rows = [tokenize_venue(venue.model_dump()) for venue in venues]
+    if db.bind.dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        version = next_row_version(db)
+        now = datetime.utcnow()
+        for row in rows:
+            row["row_version"] = version
+            row["updated_at"] = now
+        statement = mysql_insert(Venues.__table__)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in rows[0] if column != "id"})
+        db.execute(statement, rows)  # executemany, batched into multi-row INSERTs by the driver
+        db.query(VenueTombstones).filter(VenueTombstones.id.in_([row["id"] for row in rows])).delete(synchronize_session=False)
+        sync_venue_terms(db, [(row["id"], row["style_tokens"], row["keyword_tokens"]) for row in rows])
+    else:
+        for row in rows:
+            db.merge(Venues(**row))
+        db.flush()
+
+def ingest_venues(db, records, batch_size=INGEST_BATCH_SIZE, on_batch=None, max_errors=100):
+    # Validate records and upsert them in batches, committing each batch on its own
+    # so a bad row late in a large file doesn't roll back everything before it
+    stats = {"received": 0, "upserted": 0, "rejected": 0, "errors": []}
+    batch = {}
+
+    def flush():
+        if not batch:
+            return
+        upsert_venue_batch(db, list(batch.values()))
+        db.commit()
+        stats["upserted"] += len(batch)
+        batch.clear()
+        if on_batch is not None:
+            on_batch(stats)
+
+    for number, record in enumerate(records, start=1):
+        stats["received"] += 1
+        if isinstance(record, MalformedRecord):
+            stats["rejected"] += 1
+            if len(stats["errors"]) < max_errors:
+                stats["errors"].append({"record": number, "line": record.line, "detail": [{"type": "json_invalid", "loc": [], "msg": f"Invalid JSON: {record.error.msg}"}]})
+            continue
+        try:
+            venue = VenueIn.model_validate(record)
+        except ValidationError as e:
+            stats["rejected"] += 1
+            if len(stats["errors"]) < max_errors:
+                stats["errors"].append({"record": number, "detail": e.errors(include_url=False, include_input=False)})
+            continue
+        batch[venue.id] = venue  # Last occurrence of a duplicated id wins
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return stats
+
+def run_ingest(stream, fmt, batch_size):
+    db = open_session()
+    try:
+        # Derived in-memory structures are patched once per committed batch, not per row
+        return ingest_venues(db, read_venue_records(stream, fmt), batch_size, on_batch=lambda stats: sync_venue_index(db))
+    finally:
+        db.close()
+
+
+@app.post("/venues/bulk")  # Upsert venues from a CSV or JSON Lines request body
+async def bulk_ingest_venues(request: Request, format: str = None, batch_size: int = Query(INGEST_BATCH_SIZE, ge=1, le=50000)):
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "jsonl")
+    if fmt not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+
+    # Spool the body (to disk once it gets large) and parse it in a worker thread,
+    # so a big upload neither sits in memory nor blocks the event loop
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        stream = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            return await asyncio.to_thread(run_ingest, stream, fmt, batch_size)
+        except (ValueError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spool.close()
+
+
+def read_reembed_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_reembed_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def reembed_query(db, missing_only):
+    query = db.query(Venues.id, Venues.name, Venues.style, Venues.keywords, Venues.city, Venues.row_version)
+    if missing_only:
+        query = query.outerjoin(VenueEmbeddings, VenueEmbeddings.venue_id == Venues.id).filter(or_(VenueEmbeddings.venue_id.is_(None), ~current_embedding()))
+    return query
+
+def reembed_chunks(db, last_id, chunk_size, missing_only):
+    # Keyset-paged scan of the venues to embed, in id order
+    while True:
+        chunk = reembed_query(db, missing_only).filter(Venues.id > last_id).order_by(Venues.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+def store_venue_embeddings(db, venues, vectors):
+    now = datetime.utcnow()
+    rows = [{"venue_id": venue.id, "model": EMBEDDING_NAME, "venue_version": venue.row_version, "vector": np.asarray(vector, dtype=np.float32).tobytes(), "updated_at": now}
+            for venue, vector in zip(venues, vectors)]
+    if db.bind.dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        statement = mysql_insert(VenueEmbeddings.__table__)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in rows[0] if column != "venue_id"})
+        db.execute(statement, rows)
+    else:
+        db.query(VenueEmbeddings).filter(VenueEmbeddings.venue_id.in_([row["venue_id"] for row in rows])).delete(synchronize_session=False)
+        db.execute(insert(VenueEmbeddings.__table__), rows)
+    db.commit()
+
+def reembed_venues(db, chunk_size=REEMBED_CHUNK_SIZE, batch_size=REEMBED_BATCH_SIZE, processes=REEMBED_PROCESSES, checkpoint_path=REEMBED_CHECKPOINT,
+                   restart=False, missing_only=False, progress=None, stop=None, on_chunk=None):
+    # Re-embed venues in id order and store the vectors in venue_embeddings. The next
+    # chunk is read while earlier ones are encoded by `processes` model workers, and
+    # each chunk is written back in one statement. The last written id is checkpointed,
+    # so a stopped or failed run picks up where it left off unless restart is set.
+    progress = {} if progress is None else progress
+    checkpoint = None if restart else read_reembed_checkpoint(checkpoint_path)
+    if checkpoint is not None and (checkpoint.get("model"), checkpoint.get("missing_only")) != (EMBEDDING_NAME, missing_only):
+        checkpoint = None  # Left by a different kind of run
+    last_id = checkpoint["last_id"] if checkpoint else ""
+    remaining = reembed_query(db, missing_only).filter(Venues.id > last_id).count()
+    done = checkpoint["done"] if checkpoint else 0
+    started = time.time()
+    progress.update({
+        "state": "running",
+        "model": EMBEDDING_NAME,
+        "missing_only": missing_only,
+        "resumed_from": last_id or None,
+        "total": done + remaining,
+        "done": done,
+        "chunks": 0,
+        "started_at": started,
+        "elapsed_s": 0.0,
+        "venues_per_s": 0.0,
+        "eta_s": None,
+        "error": None,
+    })
+
+    def write(chunk, encoding):
+        vectors = encoding.result()
+        store_venue_embeddings(db, chunk, vectors)
+        write_reembed_checkpoint(checkpoint_path, {"model": EMBEDDING_NAME, "missing_only": missing_only, "last_id": chunk[-1].id, "done": progress["done"] + len(chunk)})
+        elapsed = time.time() - started
+        progress["done"] += len(chunk)
+        progress["chunks"] += 1
+        progress["elapsed_s"] = round(elapsed, 1)
+        progress["venues_per_s"] = round((progress["done"] - done) / max(elapsed, 1e-9), 1)
+        progress["eta_s"] = round((progress["total"] - progress["done"]) / progress["venues_per_s"], 1) if progress["venues_per_s"] else None
+        if on_chunk is not None:
+            on_chunk(progress)
+
+    pool = EmbeddingWorkerPool(EMBEDDING_MODEL, processes)
+    try:
+        pool.start()
+        with ThreadPoolExecutor(processes) as executor:
+            pending = deque()
+            for chunk in reembed_chunks(db, last_id, chunk_size, missing_only):
+                if stop is not None and stop.is_set():
+                    break
+                pending.append((chunk, executor.submit(pool.encode, [venue_text(venue) for venue in chunk], batch_size=batch_size, normalize_embeddings=True)))
+                if len(pending) >= processes:  # Keep every worker busy, but no more in flight
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+    except Exception as e:
+        progress.update(state="failed", error=str(e))
+        raise
+    finally:
+        pool.close()
+
+    if stop is not None and stop.is_set():
+        progress["state"] = "stopped"
+    else:
+        progress["state"] = "done"
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    return progress
+
+reembed_progress = {"state": "idle"}
+reembed_stop = threading.Event()
+reembed_thread = None
+
+def run_reembed(restart, missing_only):
+    global venue_index
+    db = open_session()
+    try:
+        reembed_venues(db, restart=restart, missing_only=missing_only, progress=reembed_progress, stop=reembed_stop)
+        if reembed_progress["state"] == "done" and INDEX_EMBEDDINGS:
+            # Swap in an index built from the new vectors (no model calls left to make)
+            with venue_sync_lock:
+                rebuild_venue_index(db)
+    except Exception as e:
+        print(f"Error re-embedding venues: {e}")
+    finally:
+        db.close()
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+
+# The job uses REEMBED_PROCESSES model processes; how many is a server setting, not a request parameter
+@app.post("/admin/reembed", status_code=202, dependencies=[Depends(require_admin)])  # Start re-embedding venues in the background
+async def start_reembed(restart: bool = False, missing_only: bool = False):
+    global reembed_thread
+    if reembed_thread is not None and reembed_thread.is_alive():
+        raise HTTPException(status_code=409, detail="A re-embedding job is already running")
+    reembed_stop.clear()
+    reembed_progress.clear()
+    reembed_progress["state"] = "starting"
+    reembed_thread = threading.Thread(target=run_reembed, args=(restart, missing_only), daemon=True)
+    reembed_thread.start()
+    return reembed_progress
+
+
+@app.get("/admin/reembed", dependencies=[Depends(require_admin)])  # Progress and throughput of the running or last re-embedding job
+async def get_reembed_progress():
+    return reembed_progress
+
+
+@app.delete("/admin/reembed", dependencies=[Depends(require_admin)])  # Stop the job after the chunks in flight; it resumes from its checkpoint
+async def stop_reembed():
+    if reembed_thread is None or not reembed_thread.is_alive():
+        raise HTTPException(status_code=409, detail="No re-embedding job is running")
+    reembed_stop.set()
+    return reembed_progress
+
+
+def write_similar_lists(db, index, positions):
+    # Compute and store the neighbour lists of the venues at `positions` (not committed)
+    with index.reading():
+        venue_ids = [index.columns["id"][pos] for pos in positions]
+        lists = [([index.columns["id"][pos] for pos in found], scores) for found, scores in similar_venues(index, positions, SIMILAR_WEIGHTS)]
+    versions = dict(db.query(Venues.id, Venues.row_version).filter(Venues.id.in_(venue_ids)))
+    rows = []
+    for venue_id, (found, scores) in zip(venue_ids, lists):
+        if venue_id not in versions:
+            continue  # Deleted since the index last synced
+        for position, (neighbour_id, score) in enumerate(zip(found, scores)):
+            rows.append({"venue_id": venue_id, "neighbour_id": neighbour_id, "position": position, "score": float(score), "venue_version": versions[venue_id]})
+        if not len(found):
+            rows.append({"venue_id": venue_id, "neighbour_id": venue_id, "position": -1, "score": 0.0, "venue_version": versions[venue_id]})
+    db.query(VenueNeighbours).filter(VenueNeighbours.venue_id.in_(venue_ids)).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(VenueNeighbours), rows)
+    return len(rows)
+
+def build_similar_venues(db, batch_size=SIMILAR_BATCH_SIZE, on_batch=None):
+    # Offline job: recompute every venue's neighbour list, committing one batch of venues
+    # at a time so readers keep seeing the previous lists until theirs is replaced
+    index = get_venue_index(db)
+    if index.embeddings is None:
+        raise ValueError("similar venues need venue embeddings (VENUE_INDEX_EMBEDDINGS=1)")
+    with index.reading():
+        positions = index.positions()
+    stats = {"venues": len(positions), "done": 0, "neighbours": 0, "elapsed_s": 0.0}
+    started = time.time()
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        stats["neighbours"] += write_similar_lists(db, index, batch)
+        db.commit()
+        stats["done"] += len(batch)
+        stats["elapsed_s"] = round(time.time() - started, 1)
+        if on_batch is not None:
+            on_batch(stats)
+    return stats
+
+def patch_similar_venues(db, venue_ids):
+    # Keep the stored lists in step with changed or deleted venues without a rebuild: their
+    # own lists, the lists that held them, and the lists of nearby venues they now beat
+    # the weakest entry of are recomputed
+    index = get_venue_index(db)
+    if index.embeddings is None:
+        return 0
+    changed = set(venue_ids)
+    stale = {venue_id for (venue_id,) in db.query(VenueNeighbours.venue_id).filter(VenueNeighbours.neighbour_id.in_(changed)).distinct()}
+    with index.reading():
+        for venue_id in changed:
+            pos = index.id_to_pos.get(venue_id)
+            if pos is None:
+                continue
+            sources = nearest_sources(index, pos)
+            if not len(sources):
+                continue
+            source_ids = [index.columns["id"][source] for source in sources]
+            lists = db.query(VenueNeighbours.venue_id, func.min(VenueNeighbours.score), func.count()).filter(VenueNeighbours.venue_id.in_(source_ids)).group_by(VenueNeighbours.venue_id)
+            weakest = {source_id: (floor, count) for source_id, floor, count in lists}
+            for source, source_id in zip(sources, source_ids):
+                if source_id in weakest and source_id not in stale:
+                    floor, count = weakest[source_id]
+                    if count < SIMILAR_K or similarity_scores(index, source, [pos], SIMILAR_WEIGHTS)[0] > floor:
+                        stale.add(source_id)
+        positions = [index.id_to_pos[venue_id] for venue_id in changed | stale if venue_id in index.id_to_pos]
+    db.query(VenueNeighbours).filter(VenueNeighbours.venue_id.in_(changed)).delete(synchronize_session=False)
+    for start in range(0, len(positions), SIMILAR_BATCH_SIZE):
+        write_similar_lists(db, index, positions[start:start + SIMILAR_BATCH_SIZE])
+    db.commit()
+    return len(positions)
+
+def refresh_similar_venues(db, venue_ids):
+    # Best effort after a write: a list left stale is recomputed when it is next read
+    try:
+        patch_similar_venues(db, venue_ids)
+    except Exception as e:
+        db.rollback()
+        print(f"Error patching similar venues: {e}")
+
+
+# Writes commit, sync the index (waiting on the poller, running the model) and patch the
+# similar venues lists, so the endpoints run them in a worker thread via asyncio.to_thread
+def save_venue(db, venue, fields):
+    for field, value in fields.items():
+        setattr(venue, field, value)
+    db.commit()
+    sync_venue_index(db)  # Patch search state with just this change
+    refresh_similar_venues(db, [venue.id])
+    return venue_to_dict(venue)
+
+def remove_venue(db, venue):
+    db.delete(venue)
+    db.commit()
+    sync_venue_index(db)
+    refresh_similar_venues(db, [venue.id])
+
+
+@app.post("/venues/", status_code=201)  # Create a venue
+async def create_venue(payload: VenueIn, db: Session = Depends(get_db)):
+    if db.get(Venues, payload.id) is not None:
+        raise HTTPException(status_code=409, detail="Venue already exists")
+    venue = Venues(id=payload.id)
+    db.add(venue)
+    return await asyncio.to_thread(save_venue, db, venue, payload.model_dump(exclude={"id"}))
+
+
+# Keep these last: /venues/{venue_id} would otherwise shadow the fixed /venues/... routes
+@app.post("/venues/batch-get")  # Get several venues by id in one round trip
+async def batch_get_venues(request: VenueBatchRequest, db: Session = Depends(get_db)):
+    venue_ids = list(dict.fromkeys(request.ids))
+    if len(venue_ids) > BATCH_GET_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_GET_MAX_IDS} ids per request")
+
+    found = lookup_venues(db, venue_ids)
+    return {
+        "venues": [venue_to_dict(found[venue_id]) for venue_id in venue_ids if venue_id in found],
+        "missing": [venue_id for venue_id in venue_ids if venue_id not in found],
+    }
+
+
+def stored_similar_venues(db, venue_id):
+    return db.query(VenueNeighbours.neighbour_id, VenueNeighbours.score, VenueNeighbours.venue_version).filter(
+        VenueNeighbours.venue_id == venue_id).order_by(VenueNeighbours.position).all()
+
+def similar_venue_list(db, venue_id, version):
+    # (index, stored list) of a venue, the list recomputed first if there is none yet or
+    # the venue changed since it was computed; None when the venue isn't in the index
+    index = get_venue_index(db)
+    if index.embeddings is None:
+        return index, []
+    neighbours = stored_similar_venues(db, venue_id)
+    if neighbours and neighbours[0].venue_version == version:
+        return index, neighbours
+    if venue_id not in index.id_to_pos:
+        sync_venue_index(db)  # Written by another process since the last poll
+        index = get_venue_index(db)
+    pos = index.id_to_pos.get(venue_id)
+    if pos is None:
+        return index, None
+    try:
+        write_similar_lists(db, index, [pos])
+        db.commit()
+    except (IntegrityError, OperationalError):
+        db.rollback()  # A concurrent view stored the same list first (duplicate key or deadlock)
+    return index, stored_similar_venues(db, venue_id)
+
+@app.get("/venues/{venue_id}/similar")  # Venues most like this one, from its precomputed neighbour list
+async def get_similar_venues(venue_id: str, limit: int = Query(10, ge=1, le=SIMILAR_K), db: Session = Depends(get_db)):
+    version = db.query(Venues.row_version).filter(Venues.id == venue_id).scalar()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+    index, neighbours = await asyncio.to_thread(similar_venue_list, db, venue_id, version)
+    if index.embeddings is None:
+        raise HTTPException(status_code=400, detail="similar venues need venue embeddings (VENUE_INDEX_EMBEDDINGS=1)")
+    if neighbours is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+
+    results = []
+    with index.reading():
+        for neighbour_id, score, _ in neighbours:
+            venue = index.get(neighbour_id) if neighbour_id != venue_id else None
+            if venue is not None:  # Deleted venues drop out until the list is recomputed
+                results.append(search_result(venue, score))
+    return results[:limit]
+
+
+@app.get("/venues/{venue_id}")  # Get a single venue
+async def get_venue(venue_id: str, db: Session = Depends(get_db)):
+    venue = lookup_venues(db, [venue_id]).get(venue_id)
+    if venue is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+    return venue_to_dict(venue)
+
+
+@app.put("/venues/{venue_id}")  # Replace a venue
+async def replace_venue(venue_id: str, payload: VenueFields, db: Session = Depends(get_db)):
+    venue = db.get(Venues, venue_id)
+    if venue is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+    return await asyncio.to_thread(save_venue, db, venue, payload.model_dump())
+
+
+@app.patch("/venues/{venue_id}")  # Update some fields of a venue
+async def update_venue(venue_id: str, payload: VenuePatch, db: Session = Depends(get_db)):
+    venue = db.get(Venues, venue_id)
+    if venue is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+    fields = payload.model_dump(exclude_unset=True)
+    if "name" in fields and fields["name"] is None:
+        raise HTTPException(status_code=422, detail="name cannot be null")
+    return await asyncio.to_thread(save_venue, db, venue, fields)
 
-    # Calculate match scores for all venues
-    sorted_venues = []
-    for venue in venues:
-        match_score = calculate_weighted_match_score(user_input, venue, embedding_model)
-        sorted_venues.append({
-            "id": venue.id,
-            "name": venue.name,
-            "city": venue.city,
-            "zipcode": venue.zipcode,
-            "phone": venue.phone,
-            "email": venue.email,
-            "capacity": venue.capacity,
-            "style": venue.style,
-            "keywords": venue.keywords,
-            "inquiry_url": venue.inquiry_url,
-            "match_score": round(match_score * 100, 2),
-            "photo": venue.photo  # Directly include the photo URL
-        })
-
-    # Sort by match score
-    sorted_venues.sort(key=lambda v: v["match_score"], reverse=True)
-
-    # Return the top 15 venues (still ordered by match score)
-    return sorted_venues[:15]
 
+@app.delete("/venues/{venue_id}")  # Delete a venue
+async def delete_venue(venue_id: str, db: Session = Depends(get_db)):
+    venue = db.get(Venues, venue_id)
+    if venue is None:
+        raise HTTPException(status_code=404, detail="Venue not found")
+    await asyncio.to_thread(remove_venue, db, venue)
+    return {"id": venue_id, "deleted": True}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+# Schema migrations for an existing database. Every step checks the live schema
+# first, so running it again is harmless:
+#
+#   python -m migrations
+#   python -m migrations --retokenize   # recompute every venue's tokens, e.g. after changing VENUE_TOKEN_STEMMING
+import argparse
+
+from sqlalchemy import bindparam, inspect, select, text, update
+
+from main import Base, Venues, VenueStyles, VenueKeywords, TERM_COLLATION, TERM_MAX_LENGTH, get_engine, next_row_version, sync_venue_terms, tokenize_venue
+
+
+def column_names(conn, table):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+def index_names(conn, table):
+    return {index["name"] for index in inspect(conn).get_indexes(table)}
+
+def create_missing_tables(conn):
+    Base.metadata.create_all(conn)
+
+def add_change_feed_columns(conn):
+    columns = column_names(conn, "venues")
+    if "updated_at" not in columns:
+        conn.execute(text("ALTER TABLE venues ADD COLUMN updated_at DATETIME NULL"))
+    if "row_version" not in columns:
+        conn.execute(text("ALTER TABLE venues ADD COLUMN row_version BIGINT NOT NULL DEFAULT 0"))
+    indexes = index_names(conn, "venues")
+    if "ix_venues_updated_at" not in indexes:
+        conn.execute(text("CREATE INDEX ix_venues_updated_at ON venues (updated_at)"))
+    if "ix_venues_row_version" not in indexes:
+        conn.execute(text("CREATE INDEX ix_venues_row_version ON venues (row_version)"))
+
+def seed_change_sequence(conn):
+    if conn.execute(text("SELECT COUNT(*) FROM venue_change_sequence WHERE id = 1")).scalar() == 0:
+        conn.execute(text("INSERT INTO venue_change_sequence (id, value) VALUES (1, 0)"))
+
+def add_token_columns(conn):
+    columns = column_names(conn, "venues")
+    if "style_tokens" not in columns:
+        conn.execute(text("ALTER TABLE venues ADD COLUMN style_tokens JSON NULL"))
+    if "keyword_tokens" not in columns:
+        conn.execute(text("ALTER TABLE venues ADD COLUMN keyword_tokens JSON NULL"))
+
+def binary_term_collation(conn):
+    # Tables created before venue_terms.term was declared binary compare accented and
+    # unaccented terms as equal
+    if conn.dialect.name != "mysql":
+        return
+    collation = conn.execute(text(
+        "SELECT COLLATION_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'venue_terms' AND COLUMN_NAME = 'term'"
+    )).scalar()
+    if collation != TERM_COLLATION:
+        conn.execute(text(f"ALTER TABLE venue_terms MODIFY term VARCHAR({TERM_MAX_LENGTH}) CHARACTER SET utf8mb4 COLLATE {TERM_COLLATION} NOT NULL"))
+
+def venue_batches(conn, columns, batch_size=1000, where=None):
+    # Keyset-paged scan of venues by id
+    last_id = ""
+    while True:
+        query = select(*columns).where(Venues.id > last_id).order_by(Venues.id).limit(batch_size)
+        if where is not None:
+            query = query.where(where)
+        batch = conn.execute(query).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def backfill_venue_tokens(conn, retokenize=False):
+    # Fill style_tokens/keyword_tokens for rows written before they existed. With
+    # retokenize, every row is recomputed, its term rows rewritten, and it is stamped
+    # with a new row_version so running servers pick the new tokens up.
+    venues = Venues.__table__
+    where = None if retokenize else Venues.style_tokens.is_(None)
+    version = next_row_version(conn) if retokenize else None
+    for batch in venue_batches(conn, [Venues.id, Venues.style, Venues.keywords], where=where):
+        rows = [tokenize_venue({"id": row.id, "style": row.style, "keywords": row.keywords}) for row in batch]
+        values = {"style_tokens": bindparam("new_style_tokens"), "keyword_tokens": bindparam("new_keyword_tokens")}
+        if version is not None:
+            values["row_version"] = version
+        conn.execute(
+            update(venues).where(venues.c.id == bindparam("venue_id")).values(**values),
+            [{"venue_id": row["id"], "new_style_tokens": row["style_tokens"], "new_keyword_tokens": row["keyword_tokens"]} for row in rows],
+        )
+        if retokenize:
+            sync_venue_terms(conn, [(row["id"], row["style_tokens"], row["keyword_tokens"]) for row in rows])
+
+def backfill_venue_terms(conn):
+    # Derive venue_styles/venue_keywords from the stored tokens, once
+    if conn.execute(select(VenueStyles.venue_id).limit(1)).first() or conn.execute(select(VenueKeywords.venue_id).limit(1)).first():
+        return
+    for batch in venue_batches(conn, [Venues.id, Venues.style_tokens, Venues.keyword_tokens]):
+        sync_venue_terms(conn, [tuple(row) for row in batch])
+
+
+MIGRATIONS = [
+    create_missing_tables,
+    add_change_feed_columns,
+    seed_change_sequence,
+    add_token_columns,
+    binary_term_collation,
+    backfill_venue_tokens,
+    backfill_venue_terms,
+]
+
+def migrate(retokenize=False):
+    with get_engine().begin() as conn:
+        for step in MIGRATIONS:
+            print(f"Running migration: {step.__name__}")
+            step(conn)
+        if retokenize:
+            print("Recomputing venue tokens")
+            backfill_venue_tokens(conn, retokenize=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bring the database schema up to date")
+    parser.add_argument("--retokenize", action="store_true", help="recompute style/keyword tokens for every venue")
+    migrate(parser.parse_args().retokenize)
@@ -0,0 +1,44 @@
+# Re-embed venues and store their vectors in venue_embeddings, e.g. after changing
+# EMBEDDING_MODEL / EMBEDDING_BACKEND or ingesting many venues. Runs resume from the
+# checkpoint file unless --restart is given:
+#
+#   python -m reembed
+#   python -m reembed --processes 8 --chunk-size 4096
+#   python -m reembed --missing-only   # only venues without a current vector
+import argparse
+import sys
+import time
+
+from main import REEMBED_BATCH_SIZE, REEMBED_CHECKPOINT, REEMBED_CHUNK_SIZE, REEMBED_PROCESSES, open_session, reembed_venues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed venues in parallel batches")
+    parser.add_argument("--processes", type=int, default=REEMBED_PROCESSES, help="model worker processes")
+    parser.add_argument("--chunk-size", type=int, default=REEMBED_CHUNK_SIZE, help="venues read, encoded and written per step")
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE, help="texts per model call")
+    parser.add_argument("--checkpoint", default=REEMBED_CHECKPOINT, help="file recording the last venue written")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first venue")
+    parser.add_argument("--missing-only", action="store_true", help="skip venues whose stored vector is current")
+    args = parser.parse_args()
+
+    def progress(stats):
+        eta = f", {stats['eta_s']:.0f}s left" if stats["eta_s"] is not None else ""
+        print(f"{stats['done']}/{stats['total']} venues ({stats['venues_per_s']:.0f} venues/s{eta})", file=sys.stderr)
+
+    started = time.time()
+    db = open_session()
+    try:
+        stats = reembed_venues(db, args.chunk_size, args.batch_size, args.processes, args.checkpoint, args.restart, args.missing_only, on_chunk=progress)
+    finally:
+        db.close()
+
+    if stats["resumed_from"]:
+        print(f"Resumed after venue {stats['resumed_from']}")
+    print(f"Done: {stats['done']} of {stats['total']} venues embedded with {stats['model']} in {time.time() - started:.1f}s")
+    print("Servers with the same EMBEDDING_MODEL and EMBEDDING_BACKEND use these vectors from their next index rebuild")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+
+from ann import top_k
+from venue_index import NULL_INT, capacity_similarity
+
+# "Similar venues": for each venue, the SIMILAR_K others most like it. Candidates are the
+# SIMILAR_CANDIDATES nearest venues by embedding (through the IVF index when there is
+# one), which are then reranked on a weighted mix of
+#   embedding  cosine similarity of the two venues' embeddings
+#   capacity   the search's capacity score, with this venue's capacity as the wanted one
+#   city       1 in the same city
+#   style      the share of this venue's styles the other one matches, as in search
+# The score is not symmetric: it is how well the other venue answers a search made
+# from this one.
+SIMILAR_K = int(os.getenv("VENUE_SIMILAR_K", "20"))
+SIMILAR_CANDIDATES = int(os.getenv("VENUE_SIMILAR_CANDIDATES", "200"))
+SIMILAR_BATCH_SIZE = int(os.getenv("VENUE_SIMILAR_BATCH_SIZE", "512"))  # Venues per exact-scan block and per write
+
+
+def similarity_scores(index, pos, positions, weights, embedding_scores=None):
+    # Weighted score in [0, 1] of each of `positions` as a venue like the one at `pos`
+    positions = np.asarray(positions, dtype=np.int64)
+    if embedding_scores is None:
+        embedding_scores = index.embeddings.dot(positions, index.embeddings[pos])
+    score = np.clip(embedding_scores, 0, 1) * weights['embedding']
+
+    capacity = int(index.columns["capacity"][pos])
+    if capacity != NULL_INT and capacity > 0:
+        capacities = np.asarray(index.columns["capacity"])[positions]
+        score = score + capacity_similarity(capacities, capacity, capacity) * weights['capacity']
+
+    codes = index.city_codes[0]
+    if codes[pos] >= 0:
+        score = score + (codes[positions] == codes[pos]) * weights['city']
+
+    styles = index.columns["style_tokens"][pos]
+    if styles:
+        score = score + index.style_masks.similarity(list(styles), len(index), positions) * weights['style']
+    return score / sum(weights.values())
+
+
+def embedding_candidates(index, vectors, sources, count):
+    # (positions, embedding similarities) of the `count` nearest live venues to each
+    # source, itself excluded. vectors are the sources' stored vectors; without an IVF
+    # index a block of sources is compared with every venue in one matrix product.
+    ann = index.ann
+    if ann is not None:
+        for pos, vector in zip(sources, vectors):
+            found, scores = ann.search(index.embeddings, vector, count + 1)
+            keep = found != pos
+            yield found[keep][:count], scores[keep][:count]
+        return
+    live = index.positions()
+    scores = index.embeddings.dot(None, vectors.T)[live]  # [venues, sources]
+    for column, pos in enumerate(sources):
+        found, found_scores = top_k(live, scores[:, column], count + 1)
+        keep = found != pos
+        yield found[keep][:count], found_scores[keep][:count]
+
+
+def similar_venues(index, sources, weights, k=SIMILAR_K, candidates=SIMILAR_CANDIDATES):
+    # (neighbour positions, scores) of the k best neighbours of each source position,
+    # best first
+    sources = np.asarray(sources, dtype=np.int64)
+    if not len(sources):
+        return []
+    vectors = index.embeddings[sources]
+    lists = []
+    for pos, (found, embedding_scores) in zip(sources, embedding_candidates(index, vectors, sources, candidates)):
+        scores = similarity_scores(index, pos, found, weights, embedding_scores)
+        lists.append(top_k(found, scores, k))
+    return lists
+
+
+def nearest_sources(index, pos, candidates=SIMILAR_CANDIDATES):
+    # Venues whose lists the venue at `pos` is likely to enter: its own nearest venues by
+    # embedding, whose candidates it is most likely among
+    found, _ = next(embedding_candidates(index, index.embeddings[[pos]], [pos], candidates))
+    return found
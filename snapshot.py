@@ -0,0 +1,218 @@
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+
+from venue_index import VenueIndex, STRING_FIELDS, INT_FIELDS, POSTING_FIELDS, TOKEN_COLUMNS
+from ann import IVFIndex
+from embedding_store import EmbeddingStore
+
+# On-disk layout (little endian):
+#   magic (8 bytes) | format version (uint32) | TOC length (uint32) | TOC (JSON)
+#   followed by 64-byte aligned sections described by the TOC:
+#     int:<field>              int64[n]        fixed-width integer columns (NULL_INT for NULL)
+#     str:<field>              int64[n, 2]     (offset, length) into the string table, length -1 for NULL
+#     strings                  uint8[...]      UTF-8 string table shared by every string column
+#     post:<field>:terms       int64[t, 2]     posting vocabulary, spans into the string table
+#     post:<field>:offsets     int64[t + 1]    start of each term's rows in post:<field>:rows
+#     post:<field>:rows        uint32[...]     concatenated row positions
+#     tok:<field>:offsets      int64[n + 1]    start of each venue's tokens in tok:<field>:ids (style/keywords)
+#     tok:<field>:ids          uint32[...]     per-venue token ids, indexes into post:<field>:terms
+#     embeddings               float32[n, d]   optional venue embeddings, or float16 / int8 codes
+#     embeddings:scales        float32[n]      per-venue scale of int8 codes (see embedding_store.py)
+#     embeddings:mean          float32[m]      PCA mean and components when the embeddings
+#     embeddings:components    float32[d, m]   are reduced from the model's m dimensions
+#     ann:centroids            float32[c, d]   optional IVF cell centroids (see ann.py)
+#     ann:assigned             int32[n]        IVF cell of each venue
+# Bump FORMAT_VERSION whenever this layout changes; older files are then ignored.
+MAGIC = b"WOSVIDX\x00"
+FORMAT_VERSION = 2
+ALIGN = 64
+_HEADER = struct.Struct("<8sII")
+
+
+class StringColumn:
+    # Lazily decoded view over the memory-mapped string table
+    def __init__(self, buffer, base, spans):
+        self.buffer = buffer
+        self.base = base
+        self.spans = spans
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, pos):
+        start, length = self.spans[pos]
+        if length < 0:
+            return None
+        start += self.base
+        return self.buffer[start:start + length].decode("utf-8")
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+
+class TokenColumn:
+    # Per-venue token tuples stored as ids into the field's (already decoded) vocabulary
+    def __init__(self, vocabulary, offsets, ids):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos):
+        return tuple(self.vocabulary[i] for i in self.ids[self.offsets[pos]:self.offsets[pos + 1]])
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+
+class _StringTable:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, value):
+        if value is None:
+            return (0, -1)
+        data = value.encode("utf-8")
+        self.chunks.append(data)
+        start = self.size
+        self.size += len(data)
+        return (start, len(data))
+
+    def spans(self, values):
+        return np.asarray([self.add(value) for value in values], dtype=np.int64).reshape(-1, 2)
+
+
+def write_snapshot(index, path, meta=None):
+    index = index.compacted()
+    strings = _StringTable()
+    sections = {}
+    for field in INT_FIELDS:
+        sections["int:" + field] = np.asarray(index.columns[field], dtype=np.int64)
+    for field in STRING_FIELDS:
+        sections["str:" + field] = strings.spans(index.columns[field])
+    for field in POSTING_FIELDS:
+        terms = sorted(index.postings[field])
+        rows = [np.asarray(index.postings[field][term], dtype=np.uint32) for term in terms]
+        sections["post:%s:terms" % field] = strings.spans(terms)
+        sections["post:%s:offsets" % field] = np.concatenate(([0], np.cumsum([len(r) for r in rows]))).astype(np.int64)
+        sections["post:%s:rows" % field] = np.concatenate(rows) if rows else np.empty(0, dtype=np.uint32)
+        if field in TOKEN_COLUMNS:
+            term_ids = {term: i for i, term in enumerate(terms)}
+            venue_tokens = index.columns[TOKEN_COLUMNS[field]]
+            sections["tok:%s:offsets" % field] = np.concatenate(([0], np.cumsum([len(tokens) for tokens in venue_tokens]))).astype(np.int64)
+            sections["tok:%s:ids" % field] = np.asarray([term_ids[term] for tokens in venue_tokens for term in tokens], dtype=np.uint32)
+    sections["strings"] = np.frombuffer(b"".join(strings.chunks), dtype=np.uint8)
+    if index.embeddings is not None:
+        embeddings = index.embeddings
+        sections["embeddings"] = np.ascontiguousarray(embeddings.codes)
+        if embeddings.scales is not None:
+            sections["embeddings:scales"] = np.ascontiguousarray(embeddings.scales)
+        if embeddings.components is not None:
+            sections["embeddings:mean"] = embeddings.mean
+            sections["embeddings:components"] = embeddings.components
+        if index.ann is not None:
+            sections["ann:centroids"] = index.ann.centroids
+            sections["ann:assigned"] = index.ann.assignments(np.arange(len(index)))
+
+    toc = {
+        "count": len(index),
+        "created_at": time.time(),
+        "meta": dict(index.meta, **(meta or {})),
+        "sections": {},
+    }
+    # Offsets depend on the TOC size, so lay sections out after a generously padded header
+    toc_bytes = json.dumps(toc).encode("utf-8")
+    reserve = _HEADER.size + len(toc_bytes) + 128 * (len(sections) + 1)
+    offset = _align(reserve)
+    for name, array in sections.items():
+        toc["sections"][name] = [offset, array.dtype.str, list(array.shape)]
+        offset = _align(offset + array.nbytes)
+    toc_bytes = json.dumps(toc).encode("utf-8")
+    if _HEADER.size + len(toc_bytes) > reserve:
+        raise ValueError("Snapshot table of contents does not fit in its header")
+
+    # Write to a temporary file and swap it in so readers never see a partial snapshot
+    tmp_path = "%s.tmp.%d" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(toc_bytes)))
+        f.write(toc_bytes)
+        for name, array in sections.items():
+            f.seek(toc["sections"][name][0])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    # Returns a VenueIndex backed by the mapped file, or None if the file is missing,
+    # truncated or written by a different format version
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        magic, version, toc_length = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        toc = json.loads(buffer[_HEADER.size:_HEADER.size + toc_length].decode("utf-8"))
+        sections = {}
+        for name, (offset, dtype, shape) in toc["sections"].items():
+            count = int(np.prod(shape)) if shape else 1
+            sections[name] = np.frombuffer(buffer, dtype=np.dtype(dtype), count=count, offset=offset).reshape(shape)
+    except (struct.error, ValueError, KeyError):
+        return None
+
+    base = toc["sections"]["strings"][0]
+    columns = {}
+    for field in INT_FIELDS:
+        columns[field] = sections["int:" + field]
+    for field in STRING_FIELDS:
+        columns[field] = StringColumn(buffer, base, sections["str:" + field])
+
+    postings = {}
+    for field in POSTING_FIELDS:
+        terms = list(StringColumn(buffer, base, sections["post:%s:terms" % field]))
+        offsets = sections["post:%s:offsets" % field]
+        rows = sections["post:%s:rows" % field]
+        postings[field] = {terms[i]: rows[offsets[i]:offsets[i + 1]] for i in range(len(terms))}
+        if field in TOKEN_COLUMNS:
+            columns[TOKEN_COLUMNS[field]] = TokenColumn(terms, sections["tok:%s:offsets" % field], sections["tok:%s:ids" % field])
+
+    ann = None
+    if "ann:centroids" in sections:
+        ann = IVFIndex(sections["ann:centroids"], sections["ann:assigned"])
+
+    embeddings = None
+    if "embeddings" in sections:
+        embeddings = EmbeddingStore(sections["embeddings"], sections.get("embeddings:scales"), sections.get("embeddings:mean"), sections.get("embeddings:components"))
+
+    meta = dict(toc["meta"], created_at=toc["created_at"])
+    return VenueIndex(columns, postings=postings, embeddings=embeddings, meta=meta, ann=ann)
+
+
+def snapshot_is_stale(index, max_age=None, embeddings=None):
+    # A snapshot without a change-feed watermark can't be caught up incrementally
+    if index is None or "watermark" not in index.meta:
+        return True
+    if max_age is not None and time.time() - index.meta.get("created_at", 0) > max_age:
+        return True
+    if embeddings is not None and (index.embeddings is not None) != embeddings:
+        return True  # Written with embeddings on and now off, or the other way round
+    if index.embeddings is not None and not index.embeddings.matches():
+        return True  # Written with another VENUE_EMBEDDING_STORAGE / _DIMENSIONS
+    return False
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
@@ -0,0 +1,117 @@
+import os
+
+# SymSpell-style correction of misspelled query terms against a field's vocabulary.
+# Every known term is indexed under each string obtainable by deleting up to
+# MAX_EDIT_DISTANCE characters from its first PREFIX_LENGTH characters. A query term
+# only generates its own deletes and looks them up, so a correction costs a few
+# dictionary lookups plus an edit-distance check on the handful of candidates found,
+# never a distance computation against the whole vocabulary. 0 disables correction.
+# Shorter terms allow fewer edits, since two edits turn most short words into others
+# ("folk" -> "rock"): none up to EXACT_LENGTH characters, one up to ONE_EDIT_LENGTH.
+MAX_EDIT_DISTANCE = int(os.getenv("VENUE_FUZZY_MAX_DISTANCE", "2"))
+EXACT_LENGTH = 3
+ONE_EDIT_LENGTH = 5
+PREFIX_LENGTH = 7
+MAX_CACHED_CORRECTIONS = 10000
+
+
+def allowed_distance(term, max_distance):
+    if len(term) <= EXACT_LENGTH:
+        return 0
+    if len(term) <= ONE_EDIT_LENGTH:
+        return min(max_distance, 1)
+    return max_distance
+
+
+def deletes(term, max_distance):
+    # term and every string reachable from it by deleting up to max_distance characters
+    found = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))} - found
+        found |= frontier
+    return found
+
+
+def edit_distance(a, b, max_distance):
+    # Optimal string alignment distance (adjacent transpositions count as one edit),
+    # or None once it is certain to exceed max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class SpellIndex:
+    def __init__(self, counts, max_distance=MAX_EDIT_DISTANCE, words=False):
+        # counts: {term: number of venues}, used to break ties between equally close terms.
+        # With words, the single words of multi-word terms are correctable too, for fields
+        # matched by substring ("perfromance" -> "performance", found in "performance space").
+        self.counts = counts
+        self.max_distance = max_distance
+        self.words = words
+        self.entries = {}  # Correctable string -> number of vocabulary terms providing it
+        self.candidates = {}
+        self._corrections = {}
+        for term in counts:
+            self.add(term)
+
+    def _entries(self, term):
+        return {term} | set(term.split(" ")) if self.words else {term}
+
+    def add(self, term):
+        for entry in self._entries(term):
+            self.entries[entry] = self.entries.get(entry, 0) + 1
+            if self.entries[entry] == 1:
+                for key in deletes(entry[:PREFIX_LENGTH], self.max_distance):
+                    self.candidates.setdefault(key, set()).add(entry)
+        self._corrections.clear()  # A new term may be closer than a cached correction
+
+    def discard(self, term):
+        for entry in self._entries(term):
+            remaining = self.entries.get(entry, 0) - 1
+            if remaining > 0:
+                self.entries[entry] = remaining
+                continue
+            self.entries.pop(entry, None)
+            for key in deletes(entry[:PREFIX_LENGTH], self.max_distance):
+                entries = self.candidates.get(key)
+                if entries is not None:
+                    entries.discard(entry)
+                    if not entries:
+                        del self.candidates[key]
+        self._corrections.clear()
+
+    def correct(self, term):
+        # Closest known term (or word) within the distance allowed for its length, or None. Ties go to the term
+        # on the most venues, then the word found in the most terms.
+        if term in self.entries:
+            return term
+        max_distance = allowed_distance(term, self.max_distance)
+        if max_distance <= 0:
+            return None
+        if term not in self._corrections:
+            best, best_key = None, None
+            for key in deletes(term[:PREFIX_LENGTH], max_distance):
+                for candidate in tuple(self.candidates.get(key, ())):  # Writers may patch the set meanwhile
+                    distance = edit_distance(term, candidate, max_distance)
+                    if distance is None:
+                        continue
+                    candidate_key = (distance, -self.counts.get(candidate, 0), -self.entries.get(candidate, 0), candidate)
+                    if best_key is None or candidate_key < best_key:
+                        best, best_key = candidate, candidate_key
+            if len(self._corrections) >= MAX_CACHED_CORRECTIONS:
+                self._corrections.clear()
+            self._corrections[term] = best
+        return self._corrections[term]
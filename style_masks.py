@@ -0,0 +1,95 @@
+import numpy as np
+
+WORD_BITS = 64
+
+
+class StyleMasks:
+    # Dictionary-encoded styles: every distinct style token gets an integer id and each
+    # venue's styles become a bitset over those ids (one uint64 word per 64 styles).
+    # A user's style term is resolved against the small vocabulary once per query, which
+    # turns "does any venue style contain this term" into a vectorized AND over all venues.
+
+    def __init__(self, vocabulary, masks):
+        self.vocabulary = list(vocabulary)
+        self.term_ids = {term: i for i, term in enumerate(self.vocabulary)}
+        self.masks = masks  # uint64[rows, words]
+        self._query_masks = {}
+
+    @classmethod
+    def build(cls, tokens, count):
+        if hasattr(tokens, "vocabulary"):
+            # Snapshot token column: already dictionary-encoded, no per-row decoding needed
+            vocabulary = tokens.vocabulary
+            lengths = np.diff(tokens.offsets)
+            rows = np.repeat(np.arange(count), lengths)
+            ids = np.asarray(tokens.ids, dtype=np.int64)
+        else:
+            term_ids = {}
+            rows, ids = [], []
+            for pos in range(count):
+                for term in tokens[pos] or ():
+                    rows.append(pos)
+                    ids.append(term_ids.setdefault(term, len(term_ids)))
+            vocabulary = list(term_ids)
+            rows = np.asarray(rows, dtype=np.int64)
+            ids = np.asarray(ids, dtype=np.int64)
+
+        masks = np.zeros((count, _words(len(vocabulary))), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (ids % WORD_BITS).astype(np.uint64))
+        np.bitwise_or.at(masks, (rows, ids // WORD_BITS), bits)
+        return cls(vocabulary, masks)
+
+    def query_mask(self, user_term):
+        # Bitset of vocabulary entries that contain user_term as a substring
+        mask = self._query_masks.get(user_term)
+        if mask is None:
+            mask = np.zeros(self.masks.shape[1], dtype=np.uint64)
+            for term_id, term in enumerate(self.vocabulary):
+                if user_term in term:
+                    mask[term_id // WORD_BITS] |= np.uint64(1) << np.uint64(term_id % WORD_BITS)
+            self._query_masks[user_term] = mask
+        return mask
+
+    def similarity(self, user_terms, count, positions=None):
+        # Fraction of user terms matched by each venue, for rows [0, count) or just the
+        # given positions
+        masks = self.masks[:count] if positions is None else self.masks[positions]
+        matched = np.zeros(len(masks), dtype=np.float64)
+        if not user_terms:
+            return matched
+        for term in user_terms:
+            mask = self.query_mask(term)
+            if mask.any():
+                matched += np.bitwise_and(masks, mask).any(axis=1)
+        return matched / len(user_terms)
+
+    def counts(self, positions):
+        # Number of the given rows carrying each vocabulary entry: one pass that unpacks
+        # the selected bitsets and sums each bit column
+        if len(positions) == 0 or not self.vocabulary:
+            return {}
+        bits = np.unpackbits(self.masks[positions].view(np.uint8), axis=1, bitorder="little")
+        totals = bits.sum(axis=0)[:len(self.vocabulary)]
+        return {self.vocabulary[i]: int(totals[i]) for i in np.flatnonzero(totals)}
+
+    def set_row(self, pos, tokens):
+        # Re-encode one venue, growing the vocabulary and the arrays as needed
+        for term in tokens:
+            if term not in self.term_ids:
+                self.term_ids[term] = len(self.vocabulary)
+                self.vocabulary.append(term)
+                self._query_masks.clear()  # A new style may contain cached query terms
+        rows, words = self.masks.shape
+        needed_words = _words(len(self.vocabulary))
+        if pos >= rows or needed_words > words:
+            grown = np.zeros((max(rows, pos + 1, 2 * rows if pos >= rows else rows), max(words, needed_words)), dtype=np.uint64)
+            grown[:rows, :words] = self.masks
+            self.masks = grown
+        self.masks[pos] = 0
+        for term in tokens:
+            term_id = self.term_ids[term]
+            self.masks[pos, term_id // WORD_BITS] |= np.uint64(1) << np.uint64(term_id % WORD_BITS)
+
+
+def _words(vocabulary_size):
+    return max(1, (vocabulary_size + WORD_BITS - 1) // WORD_BITS)
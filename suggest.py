@@ -0,0 +1,45 @@
+from bisect import bisect_left, insort
+import heapq
+
+# Sorts after every character a term can contain, so [prefix, prefix + _PREFIX_END)
+# is exactly the range of terms starting with prefix
+_PREFIX_END = chr(0x10FFFF)
+
+
+class PrefixIndex:
+    # Distinct terms of one field in sorted order, with the number of venues carrying
+    # each. A prefix lookup is two bisects to the matching range, then a top-k by count.
+    def __init__(self, counts):
+        self.counts = dict(counts)
+        self.terms = sorted(self.counts)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term):
+        # True when term is new to the field
+        if term in self.counts:
+            self.counts[term] += 1
+            return False
+        self.counts[term] = 1
+        insort(self.terms, term)
+        return True
+
+    def discard(self, term):
+        # True when the last venue with term is gone
+        count = self.counts.get(term)
+        if count is None:
+            return False
+        if count > 1:
+            self.counts[term] = count - 1
+            return False
+        del self.counts[term]
+        del self.terms[bisect_left(self.terms, term)]
+        return True
+
+    def suggest(self, prefix, limit=10):
+        # Most frequent terms starting with prefix, ties in alphabetical order
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + _PREFIX_END, lo)
+        counts = self.counts
+        return [(term, counts[term]) for term in heapq.nsmallest(limit, self.terms[lo:hi], key=lambda term: (-counts[term], term))]
@@ -0,0 +1,54 @@
+import os
+import re
+
+# Normalization applied once when a venue is written (and to the user's query terms),
+# so nothing has to re-split or re-lowercase venue strings at search time.
+# Changing VENUE_TOKEN_STEMMING changes stored tokens: re-run `python -m migrations --retokenize`.
+STEM_TERMS = os.getenv("VENUE_TOKEN_STEMMING", "0") == "1"
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Light suffix stripping, enough to fold plurals and -ing/-ed forms like
+# "theaters"/"theater" or "dancing"/"dance" without pulling in an NLP dependency
+_SIBILANT_PLURAL = re.compile(r"(ss|x|z|ch|sh)es$")
+
+
+def stem_word(word):
+    if not word.isalpha() or len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif _SIBILANT_PLURAL.search(word):
+        word = word[:-2]
+    elif word.endswith("ing") and len(word) > 5:
+        word = word[:-3]
+    elif word.endswith("ed") and len(word) > 4:
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    # "dance"/"danc(ing)": drop a final e so both forms meet
+    if word.endswith("e") and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def normalize_term(term, stem=STEM_TERMS):
+    term = _WHITESPACE.sub(" ", term.strip().lower())
+    if stem:
+        term = " ".join(stem_word(word) for word in term.split(" "))
+    return term
+
+
+def normalize_terms(text, stem=STEM_TERMS):
+    # Comma-separated style/keyword list (or a list of terms) -> trimmed, lowercase,
+    # de-duplicated and optionally stemmed terms, in their original order
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.split(",")
+    terms = (normalize_term(term, stem) for term in text)
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+def normalize_city(city):
+    return city.strip().lower() if city and city.strip() else None
@@ -0,0 +1,567 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import threading
+import numpy as np
+
+from tokens import normalize_terms, normalize_city
+from style_masks import StyleMasks
+from bitmaps import Bitmap
+from suggest import PrefixIndex
+from spelling import SpellIndex
+from automaton import KeywordAutomaton
+from caches import LRUCache
+from bm25 import BM25Index, venue_words
+from ann import IVFIndex, ANN_MIN_VENUES, exact_search
+from embedding_store import as_store
+
+# Columns kept in memory for every venue, in the same order as the Venues model
+VENUE_FIELDS = ("id", "name", "city", "zipcode", "phone", "email", "inquiry_url", "capacity", "style", "keywords", "photo")
+STRING_FIELDS = ("id", "name", "city", "email", "inquiry_url", "style", "keywords", "photo")
+INT_FIELDS = ("zipcode", "phone", "capacity")
+POSTING_FIELDS = ("city", "style", "keywords")
+
+# Pre-tokenized style/keyword columns (tuples of normalized terms), filled at write time
+TOKEN_COLUMNS = {"style": "style_tokens", "keywords": "keyword_tokens"}
+TOKEN_FIELDS = tuple(TOKEN_COLUMNS.values())
+
+# Integer columns are fixed-width int64, NULL is stored as this sentinel
+NULL_INT = np.iinfo(np.int64).min
+
+# Capacity bands used for filtering and facet counts: (label, lower bound inclusive)
+CAPACITY_BUCKETS = (("0-49", 0), ("50-99", 50), ("100-249", 100), ("250-499", 250), ("500-999", 500), ("1000-2499", 1000), ("2500+", 2500))
+UNKNOWN_CAPACITY = "unknown"
+_BUCKET_BOUNDS = np.array([lower for label, lower in CAPACITY_BUCKETS[1:]], dtype=np.int64)
+
+VenueRow = namedtuple("VenueRow", VENUE_FIELDS + TOKEN_FIELDS)
+
+
+def row_tokens(row, field):
+    # Stored tokens for a style/keywords field, computed from the raw string if absent
+    tokens = getattr(row, TOKEN_COLUMNS[field], None)
+    return tuple(normalize_terms(getattr(row, field)) if tokens is None else tokens)
+
+
+def field_terms(field, value):
+    # Normalize a query value the same way the field was normalized when indexed
+    if field == "city":
+        city = normalize_city(value)
+        return [city] if city else []
+    return normalize_terms(value)
+
+
+CAPACITY_LABELS = tuple(label for label, lower in CAPACITY_BUCKETS) + (UNKNOWN_CAPACITY,)
+
+
+def capacity_bucket_ids(capacities):
+    # Index into CAPACITY_LABELS for each capacity in an int64 array (NULL_INT -> unknown)
+    buckets = np.searchsorted(_BUCKET_BOUNDS, capacities, side="right")
+    buckets[capacities == NULL_INT] = len(CAPACITY_BUCKETS)
+    return buckets
+
+
+def capacity_buckets(capacities):
+    # Bucket label for each capacity in an int64 array
+    return np.array(CAPACITY_LABELS, dtype=object)[capacity_bucket_ids(capacities)]
+
+
+def capacity_similarity(capacities, low, high):
+    # How well each capacity in an int64 array fits a wanted [low, high] range, scored
+    # like the weighted match: 1 inside it, falling off in proportion outside, 0 when unknown
+    known = (capacities != NULL_INT) & (capacities != 0)
+    venue_capacity = capacities.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below = np.maximum(0, 1 - (low - venue_capacity) / low)
+        above = np.maximum(0, 1 - (venue_capacity - high) / venue_capacity)
+    scores = np.where(venue_capacity < low, below, np.where(venue_capacity > high, above, 1.0))
+    return np.where(known, np.nan_to_num(scores, nan=1.0, posinf=1.0), 0.0)
+
+
+def venue_terms(columns, field, pos):
+    if field == "capacity":
+        return [capacity_buckets(np.asarray([columns["capacity"][pos]]))[0]]
+    if field == "city":
+        city = normalize_city(columns["city"][pos])
+        return [city] if city else []
+    return columns[TOKEN_COLUMNS[field]][pos]
+
+
+def venue_text(venue):
+    # Text used to embed a venue
+    parts = [venue.name, venue.style, venue.keywords, venue.city]
+    return ". ".join(part for part in parts if part)
+
+
+def build_postings(columns, count):
+    postings = {}
+    for field in POSTING_FIELDS:
+        field_postings = {}
+        for pos in range(count):
+            for term in set(venue_terms(columns, field, pos)):
+                field_postings.setdefault(term, []).append(pos)
+        postings[field] = {term: np.asarray(rows, dtype=np.uint32) for term, rows in field_postings.items()}
+    return postings
+
+
+class ReadWriteLock:
+    # Any number of readers or one writer. Readers never wait for a queued writer, only
+    # for one that is writing, so a thread already reading can read again.
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class VenueIndex:
+    # Column-oriented, read-mostly copy of the venues table used to serve searches
+    # without going back to the database. Columns may be plain lists/arrays (built
+    # from a DB scan) or zero-copy views over a memory-mapped snapshot. apply_changes
+    # patches it in place from sync threads, so requests read it inside reading().
+
+    def __init__(self, columns, postings=None, embeddings=None, meta=None, ann=None):
+        self.columns = columns
+        self.count = len(columns["id"])
+        self.postings = postings if postings is not None else build_postings(columns, self.count)
+        self.embeddings = as_store(embeddings)  # EmbeddingStore, see embedding_store.py
+        self.meta = meta or {}
+        self.alive = None  # None until the first delete; afterwards a bool mask over row positions
+        self._id_to_pos = None
+        self._style_masks = None
+        self._bitmaps = None
+        self._city_codes = None
+        self._prefixes = None
+        self._spellers = None
+        self._keyword_matches = LRUCache(256)
+        self._resolved = LRUCache(4096)
+        self._bm25 = None
+        self._ann = ann
+        self._buffers = None
+        self._lock = threading.Lock()
+        self._access = ReadWriteLock()
+
+    @classmethod
+    def from_rows(cls, rows, embeddings=None, meta=None):
+        columns = {field: [] for field in STRING_FIELDS + TOKEN_FIELDS}
+        ints = {field: [] for field in INT_FIELDS}
+        for row in rows:
+            for field in STRING_FIELDS:
+                columns[field].append(getattr(row, field))
+            for field, column in TOKEN_COLUMNS.items():
+                columns[column].append(row_tokens(row, field))
+            for field in INT_FIELDS:
+                value = getattr(row, field)
+                ints[field].append(NULL_INT if value is None else value)
+        for field in INT_FIELDS:
+            columns[field] = np.asarray(ints[field], dtype=np.int64)
+        return cls(columns, embeddings=embeddings, meta=meta)
+
+    def __len__(self):
+        return self.count
+
+    def reading(self):
+        # Hold while reading rows, postings or derived structures; changes wait for it
+        return self._access.reading()
+
+    @property
+    def live_count(self):
+        return self.count if self.alive is None else int(self.alive[:self.count].sum())
+
+    @property
+    def id_to_pos(self):
+        # Built on first lookup so a snapshot load doesn't pay for it up front
+        if self._id_to_pos is None:
+            ids = self.columns["id"]
+            self._id_to_pos = {ids[pos]: pos for pos in range(self.count) if self.is_alive(pos)}
+        return self._id_to_pos
+
+    @property
+    def style_masks(self):
+        # Per-venue style bitsets, built on first use and then kept in step with changes
+        if self._style_masks is None:
+            with self._lock:
+                if self._style_masks is None:
+                    self._style_masks = StyleMasks.build(self.columns["style_tokens"], self.count)
+        return self._style_masks
+
+    @property
+    def bitmaps(self):
+        # Compressed bitmap postings: city/style/keywords terms, capacity buckets and the
+        # set of live rows. Built on first use and then patched per changed row.
+        if self._bitmaps is None:
+            with self._lock:
+                if self._bitmaps is None:
+                    bitmaps = {field: {term: Bitmap.from_positions(rows) for term, rows in self.postings[field].items()} for field in POSTING_FIELDS}
+                    live = self.positions()
+                    labels = capacity_buckets(np.asarray(self.columns["capacity"])[live])
+                    bitmaps["capacity"] = {label: Bitmap.from_positions(live[labels == label]) for label in set(labels)}
+                    bitmaps["live"] = Bitmap.from_positions(live)
+                    self._bitmaps = bitmaps
+        return self._bitmaps
+
+    @property
+    def prefixes(self):
+        # Sorted distinct terms per posting field with venue counts, for typeahead.
+        # Built on first use from the posting lengths, then patched per changed row.
+        if self._prefixes is None:
+            with self._lock:
+                if self._prefixes is None:
+                    self._prefixes = {field: PrefixIndex({term: len(rows) for term, rows in self.postings[field].items()}) for field in POSTING_FIELDS}
+        return self._prefixes
+
+    def suggest(self, field, prefix, limit=10):
+        return self.prefixes[field].suggest(prefix, limit)
+
+    @property
+    def spellers(self):
+        # Delete-index spelling correction over each field's vocabulary, sharing the
+        # prefix index's term counts
+        if self._spellers is None:
+            prefixes = self.prefixes
+            with self._lock:
+                if self._spellers is None:
+                    self._spellers = {field: SpellIndex(prefixes[field].counts, words=field != "city") for field in POSTING_FIELDS}
+        return self._spellers
+
+    def resolve_term(self, field, term):
+        # A normalized query term as typed when it matches the field the way search
+        # compares it (exact city, substring of a style/keyword), otherwise the closest
+        # known term within the edit distance, otherwise as typed. Kept per term until
+        # the field's vocabulary changes.
+        key = (field, term)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = term if self._matches_as_typed(field, term) else self.spellers[field].correct(term) or term
+            self._resolved.put(key, resolved)
+        return resolved
+
+    def _matches_as_typed(self, field, term):
+        known = self.prefixes[field]
+        if term in known.counts:
+            return True
+        if field == "city":
+            return False
+        if field == "keywords":
+            return bool(self.keyword_term_masks([term]))  # The automaton scan search uses
+        # Styles: the cached bitset of vocabulary entries containing the term, counting
+        # only entries some venue still has
+        style_masks = self.style_masks
+        bits = np.unpackbits(style_masks.query_mask(term).view(np.uint8), bitorder="little")
+        return any(style_masks.vocabulary[i] in known.counts for i in np.flatnonzero(bits[:len(style_masks.vocabulary)]))
+
+    def keyword_term_masks(self, user_terms):
+        # {keyword vocabulary term: mask of the user terms it contains}, bit i standing for
+        # user_terms[i]. The user terms are compiled into one automaton and the whole
+        # keyword vocabulary is scanned in a single pass; a venue then matches the union of
+        # its terms' masks. Kept per query until the vocabulary changes.
+        key = tuple(user_terms)
+        masks = self._keyword_matches.get(key)
+        if masks is None:
+            masks = KeywordAutomaton(user_terms).scan_terms(self.prefixes["keywords"].terms)
+            self._keyword_matches.put(key, masks)
+        return masks
+
+    @property
+    def bm25(self):
+        # BM25 postings over name and keyword words, built on first use and then kept in
+        # step with changes
+        if self._bm25 is None:
+            with self._lock:
+                if self._bm25 is None:
+                    self._bm25 = BM25Index.build((int(pos), self._bm25_words(pos)) for pos in self.positions())
+        return self._bm25
+
+    def _bm25_words(self, pos):
+        return venue_words(self.columns["name"][pos], self.columns["keyword_tokens"][pos])
+
+    @property
+    def ann(self):
+        # IVF index over the embeddings, trained on first use once there are enough
+        # venues for it to beat a full scan; None until then (or without embeddings)
+        if self._ann is None and self.embeddings is not None and self.live_count >= ANN_MIN_VENUES:
+            with self._lock:
+                if self._ann is None:
+                    self._ann = IVFIndex.build(self.embeddings, self.positions())
+        return self._ann
+
+    def nearest(self, query, k, positions=None, probes=None):
+        # Top k (positions, cosine similarities) to a unit query vector. Restricted to
+        # `positions` (e.g. a filter) the scan is exact; otherwise the IVF index is used
+        # when there is one.
+        query = self.embeddings.query(query)
+        if positions is None:
+            ann = self.ann
+            if ann is not None:
+                return ann.search(self.embeddings, query, k, probes)
+            positions = self.positions()
+        return exact_search(self.embeddings, positions, query, k)
+
+    @property
+    def city_codes(self):
+        # Dictionary-encoded normalized city per row (-1 when unset), as
+        # (codes, cities, city_ids, labels) where labels keep the first spelling seen
+        if self._city_codes is None:
+            with self._lock:
+                if self._city_codes is None:
+                    codes = np.full(self.count, -1, dtype=np.int32)
+                    cities, labels = [], []
+                    for term, rows in self.postings["city"].items():
+                        codes[rows] = len(cities)
+                        cities.append(term)
+                        labels.append(self.columns["city"][int(rows[0])].strip())
+                    self._city_codes = (codes, cities, {city: i for i, city in enumerate(cities)}, labels)
+        return self._city_codes
+
+    def facet_counts(self, positions):
+        # City, style and capacity-bucket counts over the given rows, each in one
+        # vectorized pass over the rows instead of a query per facet value
+        codes, cities, _, labels = self.city_codes
+        row_codes = codes[positions]
+        city_counts = np.bincount(row_codes[row_codes >= 0], minlength=len(cities))
+        bucket_counts = np.bincount(capacity_bucket_ids(np.asarray(self.columns["capacity"])[positions]), minlength=len(CAPACITY_LABELS))
+        return {
+            "city": [{"value": cities[i], "label": labels[i], "count": int(city_counts[i])} for i in np.flatnonzero(city_counts)],
+            "style": [{"value": term, "label": term, "count": count} for term, count in self.style_masks.counts(positions).items()],
+            "capacity": [{"value": label, "label": label, "count": int(count)} for label, count in zip(CAPACITY_LABELS, bucket_counts) if count],
+        }
+
+    def filter_bitmap(self, filters):
+        # filters: {field: [terms]} with field in city/style/keywords/capacity. Terms of one
+        # field are ORed, fields are ANDed, e.g. city=chicago AND (style=bar OR style=club).
+        bitmaps = self.bitmaps
+        clauses = [bitmaps["live"]]
+        for field, terms in filters.items():
+            if field != "capacity":
+                terms = [normalized for term in terms for normalized in field_terms(field, term)]
+            clauses.append(Bitmap.or_all(bitmaps[field][term] for term in terms if term in bitmaps[field]))
+        return Bitmap.and_all(clauses)
+
+    def positions(self, positions=None):
+        # Live row positions, optionally restricted to a posting list
+        if positions is None:
+            positions = np.arange(self.count)
+        if self.alive is not None:
+            positions = positions[self.alive[positions]]
+        return positions
+
+    def is_alive(self, pos):
+        return self.alive is None or bool(self.alive[pos])
+
+    def row(self, pos):
+        values = []
+        for field in VenueRow._fields:
+            value = self.columns[field][pos]
+            if field in INT_FIELDS:
+                value = None if value == NULL_INT else int(value)
+            values.append(value)
+        return VenueRow(*values)
+
+    def rows(self, positions=None):
+        if positions is None:
+            positions = range(self.count)
+        for pos in positions:
+            if self.is_alive(pos):
+                yield self.row(int(pos))
+
+    def get(self, venue_id):
+        pos = self.id_to_pos.get(venue_id)
+        return None if pos is None else self.row(pos)
+
+    def lookup(self, field, term):
+        # Row positions whose `field` contains the normalized term
+        terms = field_terms(field, term)
+        if not terms:
+            return np.empty(0, dtype=np.uint32)
+        return self.postings[field].get(terms[0], np.empty(0, dtype=np.uint32))
+
+    def apply_changes(self, upserts, deleted_ids=(), embeddings=None, watermark=None):
+        # Patch the index in place with changed rows, touching only the affected
+        # positions and posting lists. Deleted positions are masked out rather than
+        # compacted; compacted() reclaims them when the index is next persisted.
+        with self._access.writing(), self._lock:
+            self._make_writable()
+            for venue_id in deleted_ids:
+                pos = self.id_to_pos.pop(venue_id, None)
+                if pos is not None:
+                    self._unindex(pos)
+                    self.alive[pos] = False
+            for i, row in enumerate(upserts):
+                pos = self.id_to_pos.get(row.id)
+                if pos is None:
+                    pos = self._append_slot()
+                    self.id_to_pos[row.id] = pos
+                else:
+                    self._unindex(pos)
+                self._write(pos, row, None if embeddings is None else embeddings[i])
+                # Per-row arrays first, so they already cover the row once postings list it
+                if self._style_masks is not None:
+                    self._style_masks.set_row(pos, self.columns["style_tokens"][pos])
+                if self._city_codes is not None:
+                    self._set_city_code(pos)
+                self._index(pos)
+            if watermark is not None:
+                self.meta["watermark"] = watermark
+
+    def compacted(self):
+        # Copy of the index without deleted positions
+        if self.alive is None:
+            return self
+        live = np.flatnonzero(self.alive[:self.count])
+        embeddings = None if self.embeddings is None else self.embeddings.take(live)
+        compacted = VenueIndex.from_rows(self.rows(live), embeddings=embeddings, meta=dict(self.meta))
+        if self._ann is not None:
+            compacted._ann = IVFIndex(self._ann.centroids, self._ann.assignments(live), self._ann.probes)
+        return compacted
+
+    def _make_writable(self):
+        # Snapshot-backed columns are read-only views over the mapped file, so copy
+        # them into growable buffers once before the first change
+        if self._buffers is not None:
+            return
+        self.id_to_pos  # Build the id map while the original columns are still in place
+        for field in STRING_FIELDS + TOKEN_FIELDS:
+            self.columns[field] = list(self.columns[field])
+        self._buffers = {}
+        for field in INT_FIELDS:
+            self._buffers[field] = np.array(self.columns[field], dtype=np.int64)
+        self._buffers["alive"] = np.ones(self.count, dtype=bool) if self.alive is None else np.array(self.alive)
+        if self.embeddings is not None:
+            self._buffers["embeddings"] = np.array(self.embeddings.codes)
+            if self.embeddings.scales is not None:
+                self._buffers["embedding_scales"] = np.array(self.embeddings.scales)
+        self._refresh_views()
+
+    def _refresh_views(self):
+        for field in INT_FIELDS:
+            self.columns[field] = self._buffers[field][:self.count]
+        self.alive = self._buffers["alive"][:self.count]
+        if "embeddings" in self._buffers:
+            scales = self._buffers.get("embedding_scales")
+            self.embeddings = self.embeddings.view(self._buffers["embeddings"][:self.count], None if scales is None else scales[:self.count])
+
+    def _append_slot(self):
+        # Amortized O(1) append: buffers grow geometrically
+        pos = self.count
+        capacity = len(self._buffers["alive"])
+        if pos >= capacity:
+            capacity = max(16, capacity * 2)
+            for name, buffer in self._buffers.items():
+                grown = np.zeros((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+                grown[:pos] = buffer[:pos]
+                self._buffers[name] = grown
+        for field in STRING_FIELDS + TOKEN_FIELDS:
+            self.columns[field].append(None)
+        self.count += 1
+        self._refresh_views()
+        self.alive[pos] = True
+        return pos
+
+    def _vocabulary_changed(self, field, term, added):
+        self._resolved.clear()
+        if self._spellers is not None:
+            if added:
+                self._spellers[field].add(term)
+            else:
+                self._spellers[field].discard(term)
+        if field == "keywords":
+            self._keyword_matches.clear()
+
+    def _set_city_code(self, pos):
+        codes, cities, city_ids, labels = self._city_codes
+        if pos >= len(codes):
+            codes = np.concatenate((codes, np.full(max(pos + 1 - len(codes), len(codes), 16), -1, dtype=np.int32)))
+        city = normalize_city(self.columns["city"][pos])
+        if city is not None and city not in city_ids:
+            city_ids[city] = len(cities)
+            cities.append(city)
+            labels.append(self.columns["city"][pos].strip())
+        codes[pos] = -1 if city is None else city_ids[city]
+        self._city_codes = (codes, cities, city_ids, labels)
+
+    def _write(self, pos, row, embedding):
+        for field in STRING_FIELDS:
+            self.columns[field][pos] = getattr(row, field)
+        for field, column in TOKEN_COLUMNS.items():
+            self.columns[column][pos] = row_tokens(row, field)
+        for field in INT_FIELDS:
+            value = getattr(row, field)
+            self.columns[field][pos] = NULL_INT if value is None else value
+        if self.embeddings is not None:
+            self.embeddings[pos] = embedding
+
+    def _index(self, pos):
+        if self._ann is not None and self.embeddings is not None:
+            self._ann.add(pos, self.embeddings[pos])
+        if self._bm25 is not None:
+            self._bm25.set_document(pos, self._bm25_words(pos))
+        if self._bitmaps is not None:
+            self._bitmaps["live"].add(pos)
+            for field in POSTING_FIELDS + ("capacity",):
+                for term in set(venue_terms(self.columns, field, pos)):
+                    self._bitmaps[field].setdefault(term, Bitmap()).add(pos)
+        if self._prefixes is not None:
+            for field in POSTING_FIELDS:
+                for term in set(venue_terms(self.columns, field, pos)):
+                    if self._prefixes[field].add(term):
+                        self._vocabulary_changed(field, term, added=True)
+        for field in POSTING_FIELDS:
+            field_postings = self.postings[field]
+            for term in set(venue_terms(self.columns, field, pos)):
+                rows = field_postings.get(term, np.empty(0, dtype=np.uint32))
+                field_postings[term] = np.insert(rows, np.searchsorted(rows, pos), pos).astype(np.uint32)
+
+    def _unindex(self, pos):
+        if self._ann is not None:
+            self._ann.remove(pos)
+        if self._bm25 is not None:
+            self._bm25.remove_document(pos)
+        if self._bitmaps is not None:
+            self._bitmaps["live"].discard(pos)
+            for field in POSTING_FIELDS + ("capacity",):
+                for term in set(venue_terms(self.columns, field, pos)):
+                    bitmap = self._bitmaps[field].get(term)
+                    if bitmap is not None:
+                        bitmap.discard(pos)
+                        if not bitmap:
+                            del self._bitmaps[field][term]
+        if self._prefixes is not None:
+            for field in POSTING_FIELDS:
+                for term in set(venue_terms(self.columns, field, pos)):
+                    if self._prefixes[field].discard(term):
+                        self._vocabulary_changed(field, term, added=False)
+        for field in POSTING_FIELDS:
+            field_postings = self.postings[field]
+            for term in set(venue_terms(self.columns, field, pos)):
+                rows = field_postings.get(term)
+                if rows is None:
+                    continue
+                rows = rows[rows != pos]
+                if len(rows):
+                    field_postings[term] = rows
+                else:
+                    del field_postings[term]